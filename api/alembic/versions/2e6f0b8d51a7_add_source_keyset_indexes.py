@@ -0,0 +1,27 @@
+"""Add source keyset pagination indexes
+
+Revision ID: 2e6f0b8d51a7
+Revises: 9b1d3e7a4c20
+Create Date: 2026-10-18 09:40:53.107362+00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '2e6f0b8d51a7'
+down_revision = '9b1d3e7a4c20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_source_name_id', 'source', ['name', 'id'], unique=False)
+    op.create_index('ix_source_created_id', 'source', ['created', 'id'], unique=False)
+    op.create_index('ix_source_updated_id', 'source', ['updated', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_source_updated_id', table_name='source')
+    op.drop_index('ix_source_created_id', table_name='source')
+    op.drop_index('ix_source_name_id', table_name='source')
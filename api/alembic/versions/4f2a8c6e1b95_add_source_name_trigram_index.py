@@ -0,0 +1,31 @@
+"""Add source name trigram index
+
+Revision ID: 4f2a8c6e1b95
+Revises: d81c5f03a9e4
+Create Date: 2026-10-18 11:31:46.208437+00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2a8c6e1b95'
+down_revision = 'd81c5f03a9e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        'ix_source_name_trgm',
+        'source',
+        ['name'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'name': 'gin_trgm_ops'}
+    )
+
+
+def downgrade():
+    op.drop_index('ix_source_name_trgm', table_name='source')
@@ -0,0 +1,26 @@
+"""Use a GiST index for source location
+
+Revision ID: 6b8e2d4f0a17
+Revises: a3d6e0f7c812
+Create Date: 2026-10-18 12:52:37.904415+00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '6b8e2d4f0a17'
+down_revision = 'a3d6e0f7c812'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The original B-tree index cannot serve spatial predicates or <-> ordering
+    op.drop_index('ix_source_location', table_name='source')
+    op.create_index('ix_source_location', 'source', ['location'], unique=False, postgresql_using='gist')
+
+
+def downgrade():
+    op.drop_index('ix_source_location', table_name='source')
+    op.create_index('ix_source_location', 'source', ['location'], unique=False)
@@ -0,0 +1,35 @@
+"""Add ra and dec to source
+
+Revision ID: 7c4a91e2d6b3
+Revises: 2e6f0b8d51a7
+Create Date: 2026-10-18 10:12:37.550184+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4a91e2d6b3'
+down_revision = '2e6f0b8d51a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('source', sa.Column('ra', sa.Float(), nullable=True))
+    op.add_column('source', sa.Column('dec', sa.Float(), nullable=True))
+    # Geography longitudes are in [-180, 180], ra is stored in [0, 360)
+    op.execute(
+        'UPDATE source SET '
+        'ra = CASE WHEN ST_X(location::geometry) < 0 THEN ST_X(location::geometry) + 360 '
+        'ELSE ST_X(location::geometry) END, '
+        'dec = ST_Y(location::geometry)'
+    )
+    op.alter_column('source', 'ra', nullable=False)
+    op.alter_column('source', 'dec', nullable=False)
+
+
+def downgrade():
+    op.drop_column('source', 'dec')
+    op.drop_column('source', 'ra')
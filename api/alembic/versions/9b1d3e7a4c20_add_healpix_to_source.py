@@ -0,0 +1,49 @@
+"""Add healpix to source
+
+Revision ID: 9b1d3e7a4c20
+Revises: f5c0e329ec4e
+Create Date: 2026-10-18 09:02:11.482910+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.config import settings
+from app.util.healpix import ang2pix
+
+
+# revision identifiers, used by Alembic.
+revision = '9b1d3e7a4c20'
+down_revision = 'f5c0e329ec4e'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+def upgrade():
+    op.add_column('source', sa.Column('healpix', sa.BigInteger(), nullable=True))
+
+    # Backfill in id order, one batch at a time
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.text(
+            'SELECT id, ST_X(location::geometry) AS ra, ST_Y(location::geometry) AS dec FROM source '
+            'WHERE id > :last_id ORDER BY id LIMIT :limit'
+        ), {'last_id': last_id, 'limit': BACKFILL_BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        conn.execute(
+            sa.text('UPDATE source SET healpix = :healpix WHERE id = :id'),
+            [{'id': row.id, 'healpix': ang2pix(settings.healpix_order, row.ra, row.dec)} for row in rows]
+        )
+        last_id = rows[-1].id
+
+    op.alter_column('source', 'healpix', nullable=False)
+    op.create_index(op.f('ix_source_healpix'), 'source', ['healpix'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_source_healpix'), table_name='source')
+    op.drop_column('source', 'healpix')
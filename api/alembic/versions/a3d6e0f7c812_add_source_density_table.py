@@ -0,0 +1,42 @@
+"""Add source density table
+
+Revision ID: a3d6e0f7c812
+Revises: 4f2a8c6e1b95
+Create Date: 2026-10-18 12:14:05.317264+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d6e0f7c812'
+down_revision = '4f2a8c6e1b95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sourcedensity',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('updated', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('pixel', sa.BigInteger(), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('pixel')
+    )
+    op.create_index(op.f('ix_sourcedensity_id'), 'sourcedensity', ['id'], unique=False)
+
+    # Build the tiles from the existing sources
+    op.execute(sa.text(
+        'INSERT INTO sourcedensity (created, updated, pixel, count) '
+        'SELECT now(), now(), healpix >> :shift, count(*) FROM source GROUP BY healpix >> :shift'
+    ).bindparams(shift=2 * (settings.healpix_order - settings.density_order)))
+
+
+def downgrade():
+    op.drop_index(op.f('ix_sourcedensity_id'), table_name='sourcedensity')
+    op.drop_table('sourcedensity')
@@ -0,0 +1,27 @@
+"""Store source data as jsonb
+
+Revision ID: c5e7a1d93f28
+Revises: 6b8e2d4f0a17
+Create Date: 2026-10-18 13:40:12.620518+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e7a1d93f28'
+down_revision = '6b8e2d4f0a17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.alter_column('source', 'data', type_=postgresql.JSONB(), postgresql_using='data::jsonb')
+    op.create_index('ix_source_data', 'source', ['data'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_source_data', table_name='source')
+    op.alter_column('source', 'data', type_=sa.JSON(), postgresql_using='data::json')
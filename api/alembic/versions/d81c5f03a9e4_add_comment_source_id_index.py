@@ -0,0 +1,23 @@
+"""Add comment source_id index
+
+Revision ID: d81c5f03a9e4
+Revises: 7c4a91e2d6b3
+Create Date: 2026-10-18 10:58:04.911276+00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81c5f03a9e4'
+down_revision = '7c4a91e2d6b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_comment_source_id_id', 'comment', ['source_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comment_source_id_id', table_name='comment')
@@ -0,0 +1,23 @@
+"""Add comment updated index
+
+Revision ID: e2b9f4a6c17d
+Revises: c5e7a1d93f28
+Create Date: 2026-10-18 14:22:37.108452+00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b9f4a6c17d'
+down_revision = 'c5e7a1d93f28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_comment_updated_id', 'comment', ['updated', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comment_updated_id', table_name='comment')
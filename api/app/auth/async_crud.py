@@ -0,0 +1,36 @@
+"""
+asyncio counterparts of the functions in crud
+"""
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+from .security import hash_password
+from ..util.exceptions import UniquValueException
+
+
+async def create_user(db: AsyncSession, create_user: schemas.UserCreate) -> models.User:
+    if (await db.execute(select(exists().where(models.User.email == create_user.email)))).scalar():
+        raise UniquValueException(
+            'User with this email already exists.',
+            field='email',
+            value=create_user.email
+        )
+
+    # Hashing is CPU bound, keep it off the event loop
+    hashed_password = await run_in_threadpool(hash_password, create_user.password)
+    db_user = models.User(hashed_password=hashed_password, **create_user.dict(exclude={'password'}))
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+
+async def update_user(db: AsyncSession, update_user: schemas.UserUpdate, user_id: int) -> models.User:
+    result = await db.execute(select(models.User).filter_by(id=user_id))
+    db_user = result.scalars().first()
+    for field, value in update_user.dict(exclude_unset=True).items():
+        setattr(db_user, field, value)
+    await db.commit()
+    return db_user
@@ -0,0 +1,78 @@
+"""
+asyncio versions of the auth routes that touch the database on every call, used in
+place of their counterparts in views when settings.async_db is enabled
+"""
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status, BackgroundTasks
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import timedelta
+import logging
+
+from ..database import get_async_db
+from ..config import settings
+from . import schemas, models, async_crud
+from .security import authenticate_user_async, create_access_token, get_current_active_user_async
+from .views import queue_verification_email
+from ..util.exceptions import UniquValueException
+from ..util.web import conditional_response, make_etag
+
+logger = logging.getLogger('app')
+
+router = APIRouter(
+    prefix="/auth",
+    tags=["auth"]
+)
+
+
+@router.post('/token', response_model=schemas.Token)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Incorrect username or password',
+            headers={'WWW-Authenticate': 'Bearer'}
+        )
+    access_token_expires = timedelta(settings.access_token_expire_minutes)
+    access_token = create_access_token(
+        data={'sub': user.email}, expires_delta=access_token_expires
+    )
+    return {'access_token': access_token, 'token_type': 'Bearer'}
+
+
+@router.get('/users/me', response_model=schemas.UserDetail)
+async def read_users_me(
+        request: Request,
+        response: Response,
+        current_user: models.User = Depends(get_current_active_user_async)
+        ):
+    etag = make_etag(current_user.id, current_user.updated)
+    not_modified = conditional_response(request, response, etag, current_user.updated)
+    if not_modified:
+        return not_modified
+    return current_user
+
+
+@router.patch('/users/me', response_model=schemas.UserDetail)
+async def update_user_me(
+            update_user: schemas.UserUpdate,
+            current_user: models.User = Depends(get_current_active_user_async),
+            db: AsyncSession = Depends(get_async_db)
+        ):
+    return await async_crud.update_user(db, update_user, current_user.id)
+
+
+@router.post('/register', response_model=schemas.UserDetail, status_code=status.HTTP_201_CREATED)
+async def register(user_create: schemas.UserCreate, tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+    logger.info('Got request to register new user.')
+
+    try:
+        user = await async_crud.create_user(db, user_create)
+    except UniquValueException as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f'Error: {exc}'
+        )
+
+    queue_verification_email(tasks, user)
+    return user
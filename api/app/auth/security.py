@@ -1,12 +1,15 @@
 from typing import Optional
 from passlib.context import CryptContext
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import timedelta, datetime
 from jose import JWTError, jwt
 from fastapi import HTTPException, Depends, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 
-from ..database import get_db
+from ..database import get_db, get_async_db
 from ..config import settings
 from . import schemas, models
 
@@ -49,24 +52,31 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> models.User:
-    credentials_exception = HTTPException(
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='Could not validate credentials',
         headers={'WWW-Authenticate':  'Bearer'},
     )
+
+
+def get_token_username(token: str) -> str:
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=[JWT_ALGORITHM])
         username: str = payload.get('sub', '')
         if not username:
-            raise credentials_exception
+            raise credentials_exception()
         token_data = schemas.TokenData(username=username)
     except JWTError:
-        raise credentials_exception
+        raise credentials_exception()
 
-    user = get_user_by_username(db, username=token_data.username)
+    return token_data.username
+
+
+def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> models.User:
+    user = get_user_by_username(db, username=get_token_username(token))
     if user is None:
-        raise credentials_exception
+        raise credentials_exception()
 
     return user
 
@@ -77,6 +87,34 @@ def get_current_active_user(current_user: models.User = Depends(get_current_user
     return current_user
 
 
+async def authenticate_user_async(db: AsyncSession, username: str, password: str):
+    user = await get_user_by_username_async(db, username)
+    if not user:
+        return False
+    # Hashing is CPU bound, keep it off the event loop
+    if not await run_in_threadpool(verify_password, password, user.hashed_password):
+        return False
+    return user
+
+
+async def get_user_by_username_async(db: AsyncSession, username: str) -> models.User:
+    result = await db.execute(select(models.User).filter_by(email=username))
+    return result.scalars().first()
+
+
+async def get_current_user_async(db: AsyncSession = Depends(get_async_db),
+                                 token: str = Depends(oauth2_scheme)) -> models.User:
+    user = await get_user_by_username_async(db, username=get_token_username(token))
+    if user is None:
+        raise credentials_exception()
+
+    return user
+
+
+async def get_current_active_user_async(current_user: models.User = Depends(get_current_user_async)) -> models.User:
+    return get_current_active_user(current_user)
+
+
 def get_email_confirmation_link(route: str, email: str) -> str:
     confirm_token = create_access_token({'sub': email}, expires_delta=timedelta(hours=2))
     return'{route}?token={token}'.format(
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status, BackgroundTasks
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import timedelta
@@ -13,6 +13,7 @@ from .security import get_email_confirmation_link, password_reset_token, get_use
 from .security import hash_password
 from ..util.mail import send_mail
 from ..util.exceptions import UniquValueException
+from ..util.web import conditional_response, make_etag
 
 logger = logging.getLogger('app')
 
@@ -39,7 +40,11 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 
 
 @router.get('/users/me', response_model=schemas.UserDetail)
-def read_users_me(current_user: models.User = Depends(get_current_active_user)):
+def read_users_me(request: Request, response: Response, current_user: models.User = Depends(get_current_active_user)):
+    etag = make_etag(current_user.id, current_user.updated)
+    not_modified = conditional_response(request, response, etag, current_user.updated)
+    if not_modified:
+        return not_modified
     return current_user
 
 
@@ -82,6 +87,11 @@ def register(user_create: schemas.UserCreate, tasks: BackgroundTasks, db: Sessio
             detail=f'Error: {exc}'
         )
 
+    queue_verification_email(tasks, user)
+    return user
+
+
+def queue_verification_email(tasks: BackgroundTasks, user: models.User):
     confirm_link = get_email_confirmation_link(router.url_path_for('confirm_email'), user.email)
 
     with open(os.path.join(os.path.dirname(__file__), 'templates/verifyemail.txt')) as f:
@@ -98,7 +108,6 @@ def register(user_create: schemas.UserCreate, tasks: BackgroundTasks, db: Sessio
         body=body,
         to=user.email
     )
-    return user
 
 
 @router.get('/confirm_email')
@@ -1,18 +1,185 @@
+from typing import Dict, Iterator, Optional, Sequence
+from itertools import count
+import logging
+import time
+
 from sqlalchemy import create_engine, Column, Integer
+from sqlalchemy.engine import URL, Connection, Engine, make_url
+from sqlalchemy.exc import DBAPIError, TimeoutError
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlalchemy.types import DateTime
 from datetime import datetime
 
 from .config import settings
+from .util.instrumentation import instrument_engine
+from .util.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger('app')
+
+# Instrumented pools by name, the pool_logging_name of their engine
+pools: Dict[str, QueuePool] = {}
+
+pool_wait = Histogram(
+    'db_pool_checkout_seconds', 'Time waited for a pooled connection', ['pool'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+pool_overflows = Counter('db_pool_overflow_total', 'Connections opened beyond the pool size', ['pool'])
+pool_timeouts = Counter('db_pool_timeout_total', 'Checkouts which gave up waiting for a connection', ['pool'])
+pool_checked_out = Gauge(
+    'db_pool_checked_out', 'Connections in use', ['pool'],
+    collect=lambda: {(name,): pool.checkedout() for name, pool in pools.items()},
+)
+pool_size = Gauge(
+    'db_pool_size', 'Connections the pool keeps open', ['pool'],
+    collect=lambda: {(name,): pool.size() for name, pool in pools.items()},
+)
+
+
+class PoolMetrics:
+    """
+    Records checkout waits, overflow connections and timeouts of a QueuePool
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        pools[self.logging_name] = self
+
+    def connect(self):
+        start = time.perf_counter()
+        overflow = self._overflow
+        try:
+            connection = super().connect()
+        except TimeoutError:
+            pool_timeouts.inc(pool=self.logging_name)
+            raise
+        finally:
+            pool_wait.observe(time.perf_counter() - start, pool=self.logging_name)
+        # _overflow counts up from -pool_size as connections are opened
+        if self._overflow > max(overflow, 0):
+            pool_overflows.inc(pool=self.logging_name)
+        return connection
+
+
+class InstrumentedQueuePool(PoolMetrics, QueuePool):
+    pass
+
+
+class InstrumentedAsyncPool(PoolMetrics, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(name: str, **overrides) -> dict:
+    """
+    create_engine arguments for an instrumented pool named `name`, sized by settings
+    """
+    options = dict(
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        pool_logging_name=name,
+    )
+    options.update(overrides)
+    return options
+
+
+def pool_stats() -> Dict[str, dict]:
+    return {
+        name: {
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+        }
+        for name, pool in pools.items()
+    }
+
 
 SQLALCHEMY_DATABASE_URL = settings.db_string
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool, **pool_options('primary'))
+instrument_engine(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+class ReplicaRouter:
+    """
+    Hands out connections to read replicas in turn, skipping replicas which recently failed
+    """
+    def __init__(self, urls: Sequence[str]):
+        # Stale connections are replaced at checkout instead of failing the request
+        self.engines = [
+            create_engine(url, poolclass=InstrumentedQueuePool, **pool_options(f'replica{i}', pool_pre_ping=True))
+            for i, url in enumerate(urls)
+        ]
+        for replica in self.engines:
+            instrument_engine(replica)
+        self._turn = count()
+        self._ejected_until: Dict[Engine, float] = {}
+
+    def healthy(self) -> Iterator[Engine]:
+        """
+        The replicas which are not ejected, starting from the next one in turn
+        """
+        start = next(self._turn)
+        now = time.monotonic()
+        for i in range(len(self.engines)):
+            replica = self.engines[(start + i) % len(self.engines)]
+            if self._ejected_until.get(replica, 0) <= now:
+                yield replica
+
+    def eject(self, replica: Engine):
+        self._ejected_until[replica] = time.monotonic() + settings.replica_retry_after
+        logger.warning(f'Replica {replica.url!r} failed, skipping it for {settings.replica_retry_after}s')
+
+    def connect(self) -> Optional[Connection]:
+        """
+        A connection to the next healthy replica, or None if there is none
+        """
+        for replica in self.healthy():
+            try:
+                return replica.connect()
+            except DBAPIError:
+                self.eject(replica)
+        return None
+
+
+replica_router = ReplicaRouter(settings.db_replica_strings)
+
+# Drivers create_async_engine can run
+ASYNC_DRIVERS = ('asyncpg',)
+
+
+def async_database_url() -> URL:
+    """
+    settings.async_db_string, or db_string with the asyncpg driver. Other drivers are rejected
+    up front, create_async_engine only fails on the first query with them.
+    """
+    url = make_url(settings.async_db_string or settings.db_string)
+    if not settings.async_db_string:
+        url = url.set(drivername=f'{url.get_backend_name()}+asyncpg')
+    if url.get_driver_name() not in ASYNC_DRIVERS:
+        raise ValueError(f'{url.drivername} is not an asyncio driver, use one of: {", ".join(ASYNC_DRIVERS)}')
+    return url
+
+
+# Only built when the async routes are served
+async_engine: Optional[AsyncEngine] = None
+AsyncSessionLocal: Optional[sessionmaker] = None
+if settings.async_db:
+    async_engine = create_async_engine(async_database_url(), poolclass=InstrumentedAsyncPool, **pool_options('async'))
+    instrument_engine(async_engine.sync_engine)
+
+    # Objects are not expired on commit, an expired attribute cannot be lazy loaded under asyncio
+    AsyncSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession
+    )
+
+
 class BaseModel:
     """
     The BaseModel contains columns and configuration that will apply to all
@@ -37,3 +204,28 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_read_db():
+    """
+    A session on a read replica, or on the primary when no replica is configured or healthy.
+    For read only routes which tolerate replication lag, anything writing or reading its own
+    writes should use get_db.
+    """
+    connection = replica_router.connect()
+    db = SessionLocal(bind=connection) if connection is not None else SessionLocal()
+    try:
+        yield db
+    except DBAPIError as e:
+        if connection is not None and e.connection_invalidated:
+            replica_router.eject(connection.engine)
+        raise
+    finally:
+        db.close()
+        if connection is not None:
+            connection.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
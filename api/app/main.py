@@ -1,19 +1,48 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Response
 from logging.config import dictConfig
 
 from .config import settings, log_config
+from .database import SessionLocal, pool_stats
 from .sources.views import router as sources_router
+from .sources.async_views import router as async_sources_router
+from .sources.spatial import start_memory_index, stop_memory_index
+from .sources.events import event_broker
 from .auth.views import router as auth_router
+from .auth.async_views import router as async_auth_router
 from .auth.security import get_current_active_user
 from .auth.models import User
 from .util.mail import send_mail
+from .util.web import replace_routes
+from .util.cache import caches
+from .util.instrumentation import MetricsMiddleware
+from .util.metrics import PROMETHEUS_MEDIA_TYPE, render
 
 
 dictConfig(log_config)
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
 app.include_router(sources_router)
 app.include_router(auth_router)
+if settings.async_db:
+    replace_routes(app, async_sources_router)
+    replace_routes(app, async_auth_router)
+
+
+@app.on_event('startup')
+def load_memory_index():
+    if settings.source_index_engine == 'memory':
+        start_memory_index(SessionLocal)
+
+
+@app.on_event('shutdown')
+def stop_refreshing_memory_index():
+    stop_memory_index()
+
+
+@app.on_event('shutdown')
+async def stop_listening_for_events():
+    await event_broker.stop()
 
 
 @app.get('/')
@@ -21,6 +50,19 @@ async def root():
     return {'message': 'hello', 'db_string': settings.db_string, 'admin_email': settings.admin_email}
 
 
+@app.get('/stats/')
+async def stats():
+    return {'caches': {name: cache.stats() for name, cache in caches.items()}, 'pools': pool_stats()}
+
+
+@app.get('/metrics')
+def metrics():
+    """
+    Request, SQL and connection pool metrics of this worker in the Prometheus text format
+    """
+    return Response(render(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+
 @app.get('/secure/')
 async def secure(user: User = Depends(get_current_active_user)):
     return {'user': user.email}
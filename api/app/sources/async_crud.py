@@ -0,0 +1,127 @@
+"""
+asyncio counterparts of the functions in crud, sharing its query building
+"""
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas, filters
+from .crud import COMMENT_SORT_KEYS, SORT_KEYS, SOURCE_COLUMNS, LIST_COLUMNS, filter_sources, source_detail_statement
+from .crud import DETAIL_FIELDS, list_options, source_page_key, source_page_validators_statement
+from .crud import SourcePage, SourceVersion, source_cache, source_list_cache, source_page, source_version_statement
+from .crud import density_increment_statement
+from .events import comment_event_statement, source_event_statement
+from .spatial import index_sources
+from ..util.web import ListQueryParams, keyset_next_segment, keyset_paginate, page_validators, sparse_model
+
+
+async def get_source(db: AsyncSession, source_id: int, fields: Sequence[str] = DETAIL_FIELDS) -> models.Source:
+    result = await db.execute(source_detail_statement(source_id, fields))
+    return result.unique().scalars().one_or_none()
+
+
+async def get_source_version(db: AsyncSession, source_id: int) -> Optional[SourceVersion]:
+    result = await db.execute(source_version_statement(source_id))
+    row = result.one_or_none()
+    return None if row is None else SourceVersion(*row)
+
+
+async def get_source_cached(db: AsyncSession, source_id: int, version: SourceVersion,
+                            fields: Sequence[str] = DETAIL_FIELDS) -> Optional[Tuple[SourceVersion, BaseModel]]:
+    model = sparse_model(schemas.Source, tuple(fields))
+    entry = source_cache.get(source_id)
+    if entry is None or entry[0] != version:
+        db_source = await get_source(db, source_id, fields)
+        if db_source is None:
+            return None
+        if model is not schemas.Source:
+            return SourceVersion.of(db_source, fields), model.from_orm(db_source)
+        entry = SourceVersion.of(db_source), schemas.Source.from_orm(db_source)
+        source_cache.set(source_id, entry)
+    read_version, source = entry
+    return read_version, source if model is schemas.Source else model.from_orm(source)
+
+
+async def get_comments(db: AsyncSession, source_id: int, list_params: ListQueryParams) -> List[models.Comment]:
+    stmt = select(models.Comment).filter(models.Comment.source_id == source_id)
+    result = await db.execute(keyset_paginate(stmt, list_params, COMMENT_SORT_KEYS, models.Comment.id))
+    return result.scalars().all()
+
+
+async def get_sources(db: AsyncSession, list_params: ListQueryParams, source_filter: filters.SourceFilter,
+                      fields: Sequence[str] = LIST_COLUMNS) -> List[models.Source]:
+    stmt = filter_sources(select(models.Source).options(list_options(list_params, fields)), source_filter)
+    result = await db.execute(keyset_paginate(stmt, list_params, SORT_KEYS, models.Source.id))
+    sources = result.scalars().all()
+    rest = keyset_next_segment(stmt, list_params, SORT_KEYS, models.Source.id, len(sources))
+    if rest is not None:
+        result = await db.execute(rest)
+        sources += result.scalars().all()
+    return sources
+
+
+async def get_source_page_validators(db: AsyncSession, list_params: ListQueryParams,
+                                     source_filter: filters.SourceFilter,
+                                     fields: Sequence[str] = LIST_COLUMNS) -> Tuple[str, Optional[datetime]]:
+    page = source_list_cache.get(source_page_key(list_params, source_filter, fields))
+    if page is not None:
+        return page.etag, page.last_modified
+    stmt = source_page_validators_statement(source_filter)
+    result = await db.execute(keyset_paginate(stmt, list_params, SORT_KEYS, models.Source.id))
+    rows = result.all()
+    rest = keyset_next_segment(stmt, list_params, SORT_KEYS, models.Source.id, len(rows))
+    if rest is not None:
+        result = await db.execute(rest)
+        rows += result.all()
+    return page_validators(rows, fields)
+
+
+async def get_sources_cached(db: AsyncSession, list_params: ListQueryParams, source_filter: filters.SourceFilter,
+                             fields: Sequence[str] = LIST_COLUMNS) -> SourcePage:
+    key = source_page_key(list_params, source_filter, fields)
+    page = source_list_cache.get(key)
+    if page is None:
+        page = source_page(await get_sources(db, list_params, source_filter, fields), list_params, fields)
+        source_list_cache.set(key, page)
+    return page
+
+
+async def stream_source_partitions(db: AsyncSession, list_params: ListQueryParams,
+                                   source_filter: filters.SourceFilter,
+                                   columns: Sequence[str] = LIST_COLUMNS) -> AsyncIterator[List[Row]]:
+    stmt = filter_sources(select(*(SOURCE_COLUMNS[name] for name in columns)), source_filter)
+    count = 0
+    result = await db.stream(keyset_paginate(stmt, list_params, SORT_KEYS, models.Source.id))
+    async for partition in result.partitions():
+        count += len(partition)
+        yield partition
+    rest = keyset_next_segment(stmt, list_params, SORT_KEYS, models.Source.id, count)
+    if rest is not None:
+        result = await db.stream(rest)
+        async for partition in result.partitions():
+            yield partition
+
+
+async def create_source(db: AsyncSession, source: schemas.CreateSource) -> models.Source:
+    db_source = models.Source(**source.dict(), comments=[])
+    db.add(db_source)
+    await db.execute(density_increment_statement([db_source.healpix]))
+    await db.flush()
+    await db.execute(source_event_statement(db_source))
+    await db.commit()
+    source_list_cache.clear()
+    index_sources([db_source])
+    return db_source
+
+
+async def create_comment(db: AsyncSession, comment: schemas.Comment, source_id: int) -> models.Comment:
+    db_comment = models.Comment(**comment.dict(), source_id=source_id)
+    db.add(db_comment)
+    await db.flush()
+    await db.execute(comment_event_statement(db_comment))
+    await db.commit()
+    source_cache.pop(source_id)
+    return db_comment
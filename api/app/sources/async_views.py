@@ -0,0 +1,113 @@
+"""
+asyncio versions of the hot source routes, used in place of their counterparts
+in views when settings.async_db is enabled
+"""
+from fastapi import APIRouter, Depends, Request, Response
+from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import async_crud, crud, schemas, filters
+from .views import columnar_columns
+from ..database import get_async_db
+from ..util.columnar import COLUMNAR_MEDIA_TYPE, ColumnarEncoder
+from ..util.web import ListQueryParams, NDJSON_MEDIA_TYPE, NEXT_CURSOR_HEADER, accepts, ndjson_response
+from ..util.web import FieldsParams, conditional_response, is_conditional, model_response
+
+router = APIRouter(
+    prefix="/sources",
+    tags=["sources"]
+)
+
+
+@router.get('/', response_model=List[schemas.ListSource])
+async def get_sources(
+        request: Request,
+        response: Response,
+        list_params: ListQueryParams = Depends(),
+        source_filter: filters.SourceFilter = Depends(),
+        fields_params: FieldsParams = Depends(),
+        db: AsyncSession = Depends(get_async_db)
+        ):
+    fields = fields_params.select(schemas.ListSource)
+    if accepts(request, NDJSON_MEDIA_TYPE):
+        partitions = async_crud.stream_source_partitions(db, list_params, source_filter, fields)
+        return ndjson_response(row._asdict() async for partition in partitions for row in partition)
+
+    if accepts(request, COLUMNAR_MEDIA_TYPE):
+        columns = columnar_columns(fields)
+        columns_read = [name for name, _ in columns]
+        encoder = ColumnarEncoder(columns)
+        async for partition in async_crud.stream_source_partitions(db, list_params, source_filter, columns_read):
+            encoder.add(partition)
+        return Response(encoder.encode(), media_type=COLUMNAR_MEDIA_TYPE)
+
+    if is_conditional(request):
+        # Answer from the validators alone when the page is unchanged
+        validators = await async_crud.get_source_page_validators(db, list_params, source_filter, fields)
+        not_modified = conditional_response(request, response, *validators)
+        if not_modified:
+            return not_modified
+    page = await async_crud.get_sources_cached(db, list_params, source_filter, fields)
+    not_modified = conditional_response(request, response, page.etag, page.last_modified)
+    if not_modified:
+        return not_modified
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    if fields_params.fields:
+        return model_response(response, page.items)
+    return page.items
+
+
+@router.post('/', response_model=schemas.Source)
+async def create_source(source: schemas.CreateSource, db: AsyncSession = Depends(get_async_db)):
+    return await async_crud.create_source(db, source)
+
+
+@router.get('/{source_id}', response_model=schemas.Source)
+async def get_source(
+        source_id: int,
+        request: Request,
+        response: Response,
+        fields_params: FieldsParams = Depends(),
+        db: AsyncSession = Depends(get_async_db)
+        ):
+    fields = fields_params.select(schemas.Source)
+    version = await async_crud.get_source_version(db, source_id)
+    if version is None:
+        return None
+    not_modified = conditional_response(request, response, *crud.source_validators(source_id, version, fields))
+    if not_modified:
+        return not_modified
+    read = await async_crud.get_source_cached(db, source_id, version, fields)
+    if read is None:
+        return None
+    read_version, source = read
+    if read_version != version:
+        # Changed since its version was read, the validators describe the representation sent
+        not_modified = conditional_response(request, response, *crud.source_validators(source_id, read_version, fields))
+        if not_modified:
+            return not_modified
+    if fields_params.fields:
+        return model_response(response, source)
+    return source
+
+
+@router.get('/{source_id}/comments', response_model=List[schemas.ListComment])
+async def get_comments(
+        source_id: int,
+        response: Response,
+        list_params: ListQueryParams = Depends(),
+        db: AsyncSession = Depends(get_async_db)
+        ):
+    if not list_params.keyset:
+        list_params.sort = 'id'
+    comments = await async_crud.get_comments(db, source_id, list_params)
+    next_cursor = list_params.next_cursor(comments)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return comments
+
+
+@router.post('/{source_id}/comment', response_model=schemas.Comment)
+async def create_comment(source_id: int, comment: schemas.Comment, db: AsyncSession = Depends(get_async_db)):
+    return await async_crud.create_comment(db, comment, source_id)
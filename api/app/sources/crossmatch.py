@@ -0,0 +1,129 @@
+"""
+Cross-matching of uploaded position catalogs against Sources.
+
+Positions are read as NDJSON (one CrossmatchPosition per line) or CSV with a
+header row of id,ra,dec[,radius], radius in degrees. They are copied into a
+temporary table, then matched against source with a single spatial join, so a
+catalog costs one query instead of one cone search per position.
+"""
+from typing import Any, Dict, Iterator, List, Tuple
+from enum import Enum
+import io
+
+import numpy as np
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy import BigInteger, Column, Float, MetaData, String, Table, select, text, true
+from sqlalchemy.orm import Session
+from geoalchemy2 import Geography
+
+from . import models, schemas
+from .crud import SOURCE_COLUMNS, LIST_COLUMNS
+from .ingest import Format, RecordParser, copy_value
+from ..config import settings
+from ..util.calc import degrees_to_meters, ewkb_points, normalize_ra
+
+# Created per request with ON COMMIT DROP, so it lives in its own metadata rather than Base's
+positions = Table(
+    'crossmatch_position',
+    MetaData(),
+    Column('ordinal', BigInteger, nullable=False),
+    Column('position_id', String, nullable=False),
+    Column('radius', Float, nullable=False),
+    Column('location', Geography('POINT', srid=settings.srid, spatial_index=False), nullable=False),
+    prefixes=['TEMPORARY'],
+    postgresql_on_commit='DROP',
+)
+
+
+class Match(str, Enum):
+    best = 'best'
+    all = 'all'
+
+
+class PositionLoader:
+    """
+    Validates batches of raw lines as CrossmatchPosition records and copies them into the
+    crossmatch_position table of the current transaction. Any invalid record rejects the upload.
+    """
+    def __init__(self, db: Session, fmt: Format = Format.ndjson, radius: float = 1 / 3600):
+        self.db = db
+        self.parser = RecordParser(fmt)
+        self.radius = radius
+        self.count = 0
+        self.created = False
+
+    def create_table(self):
+        if not self.created:
+            positions.create(self.db.connection())
+            self.created = True
+
+    def load_batch(self, lines: List[Tuple[int, str]]):
+        self.create_table()
+        batch = []
+        for line_number, line in lines:
+            try:
+                if self.parser.expects_header:
+                    self.parser.parse(line)
+                    continue
+                batch.append(schemas.CrossmatchPosition(**self.parser.parse(line)))
+            except (ValueError, TypeError, ValidationError) as exc:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f'Line {line_number}: {exc}'
+                )
+        if self.count + len(batch) > settings.crossmatch_max_positions:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f'At most {settings.crossmatch_max_positions} positions can be matched at once'
+            )
+        if not batch:
+            return
+
+        ra = normalize_ra([position.ra for position in batch])
+        dec = np.array([position.dec for position in batch])
+        radii = np.array([position.radius or self.radius for position in batch])
+        columns = (
+            range(self.count + 1, self.count + len(batch) + 1),
+            [position.id for position in batch],
+            degrees_to_meters(radii).tolist(),
+            ewkb_points(ra, dec, settings.srid).astype(str).tolist(),
+        )
+        self.count += len(batch)
+
+        buffer = io.StringIO()
+        for row in zip(*columns):
+            buffer.write('\t'.join(copy_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        cursor = self.db.connection().connection.cursor()
+        cursor.copy_expert(f'COPY {positions.name} ({", ".join(positions.c.keys())}) FROM STDIN', buffer)
+
+    def matches(self, match: Match = Match.best, unmatched: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the sources within the radius of each position in upload order, nearest first with
+        their separation in degrees. Match.best keeps only the nearest source. With unmatched,
+        positions without any match are included with a null source.
+        """
+        if not self.count:
+            return
+        # Temporary tables are never analyzed automatically
+        self.db.execute(text(f'ANALYZE {positions.name}'))
+
+        distance = models.Source.location.op('<->', return_type=Float)(positions.c.location)
+        candidates = select(
+            *(SOURCE_COLUMNS[name] for name in LIST_COLUMNS), (distance / degrees_to_meters(1)).label('separation')
+        ).where(models.Source.location.ST_DWithin(positions.c.location, positions.c.radius))
+        if match == Match.best:
+            candidates = candidates.order_by(distance, models.Source.id).limit(1)
+        candidates = candidates.lateral('candidate')
+
+        stmt = select(positions.c.position_id, candidates).select_from(
+            positions.join(candidates, true(), isouter=unmatched)
+        ).order_by(
+            positions.c.ordinal, candidates.c.separation, candidates.c.id
+        ).execution_options(stream_results=True)
+
+        for row in self.db.execute(stmt).yield_per(settings.stream_batch_size):
+            source = {name: row._mapping[name] for name in LIST_COLUMNS} if row.id is not None else None
+            yield {'id': row.position_id, 'source': source, 'separation': row.separation}
@@ -1,42 +1,575 @@
-from typing import List
-from sqlalchemy.orm import Session
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from collections import Counter
+from operator import attrgetter, itemgetter
+from datetime import datetime, timedelta
+from itertools import groupby
+import json
+from pydantic import BaseModel
+from sqlalchemy import BigInteger, Float, Integer, String
+from sqlalchemy import and_, any_, cast, column, func, literal, or_, select, text, true, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Row
+from sqlalchemy.types import UserDefinedType
+from sqlalchemy.orm import Session, aliased, contains_eager, load_only
 
 from . import models, schemas, filters
-from ..util.web import ListQueryParams
+from .events import comment_event_statement, source_event_statement
+from .spatial import index_sources, memory_index, use_memory_index
+from ..util.web import ListQueryParams, keyset_next_segment, keyset_paginate, make_etag, page_validators, sparse_model
+from ..util.cache import LRUCache, cache_key
 from ..util.calc import degrees_to_meters, wkt_point
+from ..util.healpix import cone_ranges, cover_cone, merge_ranges
+from ..util.regions import BOX_PADDING, POLE_MARGIN, box_ewkt, polygon_ewkt
 from ..config import settings
 
 
-def get_source(db: Session, source_id: int) -> models.Source:
-    return db.query(models.Source).filter(models.Source.id == source_id).first()
+# Serialized results of get_source by id, as (SourceVersion, Source), and of get_sources by normalized
+# parameters. create_source clears the list cache, create_comment drops the detail of its source.
+source_cache = LRUCache('source', settings.source_cache_size, settings.source_cache_ttl)
+source_list_cache = LRUCache('source_list', settings.source_cache_size, settings.source_cache_ttl)
 
 
-def get_sources(db: Session, list_params: ListQueryParams, source_filter: filters.SourceFilter) -> List[models.Source]:
-    query = db.query(models.Source)
+class SourcePage(NamedTuple):
+    """
+    A serialized page of get_sources with its pagination cursor and validators. Items are
+    ListSource, or a sparse_model of it when only some fields were requested.
+    """
+    items: List[BaseModel]
+    next_cursor: Optional[str]
+    etag: str
+    last_modified: Optional[datetime]
 
+
+# Pixel budget for covering a cone with density tiles, a finer covering leaves fewer sources to count exactly
+DENSITY_MAX_PIXELS = 1024
+
+# Cones matching more sources than this in the memory index are searched by PostGIS rather than
+# sent to it as a list of ids
+MEMORY_INDEX_MAX_IDS = 100000
+
+# jsonpath comparisons of the data filter operators
+JSONPATH_OPERATORS = {'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}
+
+# Keys accepted by ListQueryParams.sort, each is backed by a (column, id) index
+SORT_KEYS = {
+    'id': models.Source.id,
+    'name': models.Source.name,
+    'created': models.Source.created,
+    'updated': models.Source.updated,
+}
+COMMENT_SORT_KEYS = {
+    'id': models.Comment.id,
+}
+
+# Feeds of get_changes in cursor order, each read from an (updated, id) index
+CHANGE_FEEDS = ('sources', 'comments')
+
+# Columns which can be selected by iter_source_partitions
+SOURCE_COLUMNS = {
+    'id': models.Source.id,
+    'name': models.Source.name,
+    'ra': models.Source.ra,
+    'dec': models.Source.dec,
+    'data': models.Source.data,
+}
+LIST_COLUMNS = ('id', 'name', 'ra', 'dec', 'data')
+DETAIL_FIELDS = tuple(schemas.Source.__fields__)
+
+
+class SourceVersion(NamedTuple):
+    """
+    Updated time of a Source with the id and updated time of its latest comment, which change
+    whenever its detail does. Comments are only ever added, so the latest one is enough.
+    """
+    updated: datetime
+    comment_id: Optional[int]
+    comment_updated: Optional[datetime]
+
+    @classmethod
+    def of(cls, source: models.Source, fields: Sequence[str] = DETAIL_FIELDS) -> 'SourceVersion':
+        """
+        The version of a Source read by source_detail_statement, its comments are only looked at
+        when they are among fields and were loaded
+        """
+        latest = max(source.comments, key=attrgetter('id'), default=None) if 'comments' in fields else None
+        return cls(source.updated, latest and latest.id, latest and latest.updated)
+
+
+def load_columns(fields: Iterable[str], *required: str):
+    """
+    Loader option reading only the Source columns among fields and required. The others, data
+    and the location geography in particular, are deferred and never sent by the database.
+    """
+    names = {'id', *fields, *required}.intersection(models.Source.__table__.c.keys())
+    return load_only(*(getattr(models.Source, name) for name in sorted(names)))
+
+
+def source_detail_statement(source_id: int, fields: Sequence[str] = DETAIL_FIELDS):
+    """
+    Select a Source together with its latest settings.source_inline_comments comments in a single
+    query, loading Source.comments from a LATERAL subquery instead of a lazy load of every comment.
+    Only the columns of `fields` and updated are read, and comments only if they are one of them.
+    """
+    if 'comments' not in fields:
+        return select(models.Source).options(load_columns(fields, 'updated')).where(models.Source.id == source_id)
+
+    latest = select(models.Comment).where(
+        models.Comment.source_id == models.Source.id
+    ).order_by(models.Comment.id.desc()).limit(settings.source_inline_comments).lateral('latest_comments')
+    comment = aliased(models.Comment, latest)
+
+    return select(models.Source).outerjoin(comment, true()).options(
+        load_columns(fields, 'updated'), contains_eager(models.Source.comments.of_type(comment))
+    ).where(models.Source.id == source_id).order_by(comment.id.desc())
+
+
+def get_source(db: Session, source_id: int, fields: Sequence[str] = DETAIL_FIELDS) -> models.Source:
+    return db.execute(source_detail_statement(source_id, fields)).unique().scalars().one_or_none()
+
+
+def source_version_statement(source_id: int):
+    """
+    Select the SourceVersion of a Source
+    """
+    latest = select(models.Comment.id, models.Comment.updated).where(
+        models.Comment.source_id == models.Source.id
+    ).order_by(models.Comment.id.desc()).limit(1).lateral('latest_comment')
+
+    return select(models.Source.updated, latest.c.id, latest.c.updated).outerjoin(
+        latest, true()
+    ).where(models.Source.id == source_id)
+
+
+def get_source_version(db: Session, source_id: int) -> Optional[SourceVersion]:
+    row = db.execute(source_version_statement(source_id)).one_or_none()
+    return None if row is None else SourceVersion(*row)
+
+
+def source_validators(source_id: int, version: SourceVersion, fields: Sequence[str]) -> Tuple[str, datetime]:
+    """
+    ETag and Last-Modified of the detail of a source at version, with only `fields`. Comments
+    only count when they are among fields.
+    """
+    updated, comment_id, comment_updated = version if 'comments' in fields else (version.updated, None, None)
+    return make_etag(source_id, updated, comment_id, comment_updated, fields), max(updated, comment_updated or updated)
+
+
+def get_source_cached(db: Session, source_id: int, version: SourceVersion,
+                      fields: Sequence[str] = DETAIL_FIELDS) -> Optional[Tuple[SourceVersion, BaseModel]]:
+    """
+    A Source, or a sparse_model of it with only `fields`, with the version it was read at. It is
+    built from source_cache when the cached copy is at `version`, the current one according to
+    get_source_version, and read again otherwise. Sources read with only some of their fields
+    are not cached.
+    """
+    model = sparse_model(schemas.Source, tuple(fields))
+    entry = source_cache.get(source_id)
+    if entry is None or entry[0] != version:
+        db_source = get_source(db, source_id, fields)
+        if db_source is None:
+            return None
+        if model is not schemas.Source:
+            return SourceVersion.of(db_source, fields), model.from_orm(db_source)
+        entry = SourceVersion.of(db_source), schemas.Source.from_orm(db_source)
+        source_cache.set(source_id, entry)
+    read_version, source = entry
+    return read_version, source if model is schemas.Source else model.from_orm(source)
+
+
+def get_comments(db: Session, source_id: int, list_params: ListQueryParams) -> List[models.Comment]:
+    query = db.query(models.Comment).filter(models.Comment.source_id == source_id)
+    return keyset_paginate(query, list_params, COMMENT_SORT_KEYS, models.Comment.id).all()
+
+
+def filter_sources(query, source_filter: filters.SourceFilter):
+    """
+    Apply a SourceFilter to a Query or Select over the source table
+    """
     if source_filter.name_contains:
-        query = query.filter(models.Source.name.contains(source_filter.name_contains))
+        # Served by the ix_source_name_trgm trigram index
+        query = query.filter(models.Source.name.contains(source_filter.name_contains, autoescape=True))
 
     if source_filter.cone:
         ra, dec, radius = source_filter.cone
-        query = query.filter(
-            models.Source.location.ST_DWithin(wkt_point(ra, dec, settings.srid), degrees_to_meters(radius))
-        )
+        ids = memory_index.cone(ra, dec, radius) if use_memory_index() else None
+        if ids is not None and len(ids) <= MEMORY_INDEX_MAX_IDS:
+            query = query.filter(models.Source.id == any_(id_array(ids)))
+        else:
+            # Prefilter on the HEALPix pixels covering the cone before the exact distance check
+            pixel_ranges = cone_ranges(settings.healpix_order, ra, dec, radius)
+            query = query.filter(
+                or_(*(models.Source.healpix.between(start, stop - 1) for start, stop in pixel_ranges)),
+                models.Source.location.ST_DWithin(wkt_point(ra, dec, settings.srid), degrees_to_meters(radius))
+            )
+
+    if source_filter.box_bounds:
+        query = query.filter(box_clause(*source_filter.box_bounds))
+
+    if source_filter.polygon_vertices:
+        polygon = func.ST_GeogFromText(polygon_ewkt(source_filter.polygon_vertices, settings.srid))
+        query = query.filter(models.Source.location.ST_Intersects(polygon))
+
+    for path, operator, value in source_filter.data_conditions:
+        query = query.filter(data_clause(path, operator, value))
+
+    return query
+
+
+class JSONPath(UserDefinedType):
+    def get_col_spec(self, **kw):
+        return 'jsonpath'
+
+
+def data_clause(path: List[str], operator: str, value: Any):
+    """
+    A condition on the value at a key path of Source.data. Equality compiles to containment (@>)
+    and key existence to ? or a jsonpath, which the GIN index on data serves. Ranges compile to
+    jsonpath filters, where the index can only narrow the search down to rows having the key.
+    """
+    if operator == 'eq':
+        document = value
+        for key in reversed(path):
+            document = {key: document}
+        return models.Source.data.contains(document)
+    if operator == 'exists' and len(path) == 1:
+        return models.Source.data.has_key(path[0])
+
+    jsonpath = '$' + ''.join(f'.{json.dumps(key)}' for key in path)
+    if operator != 'exists':
+        jsonpath += f' ? (@ {JSONPATH_OPERATORS[operator]} {json.dumps(value)})'
+    return models.Source.data.bool_op('@?')(cast(literal(jsonpath), JSONPath()))
+
+
+def box_clause(ra_min: float, dec_min: float, ra_max: float, dec_max: float):
+    """
+    Sources inside an RA/Dec box. The location index narrows the search down to a polygon,
+    or a polar cap, covering the box and the exact bounds are checked on ra and dec.
+    """
+    if ra_max >= ra_min:
+        ra = models.Source.ra.between(ra_min, ra_max)
+    else:
+        ra = or_(models.Source.ra >= ra_min, models.Source.ra <= ra_max)
+    exact = and_(ra, models.Source.dec.between(dec_min, dec_max))
+
+    north, south = dec_max > 90 - POLE_MARGIN, dec_min < -90 + POLE_MARGIN
+    if north and south:
+        return exact
+    if north or south:
+        pole = wkt_point(0, 90 if north else -90, settings.srid)
+        radius = 90 - (dec_min if north else -dec_max) + BOX_PADDING
+        return and_(models.Source.location.ST_DWithin(pole, degrees_to_meters(radius)), exact)
+    covering = func.ST_GeogFromText(box_ewkt(ra_min, dec_min, ra_max, dec_max, settings.srid))
+    return and_(models.Source.location.ST_Intersects(covering), exact)
+
+
+def id_array(ids: Sequence[int]):
+    return literal([int(i) for i in ids], ARRAY(Integer))
+
+
+def list_options(list_params: ListQueryParams, fields: Sequence[str]):
+    """
+    Loader option for listing the columns of fields, with those the cursor and validators need
+    """
+    sort, _ = list_params.keyset_position()
+    return load_columns(fields, 'updated', sort.lstrip('-'))
+
+
+def get_sources(db: Session, list_params: ListQueryParams, source_filter: filters.SourceFilter,
+                fields: Sequence[str] = LIST_COLUMNS) -> List[models.Source]:
+    query = db.query(models.Source).options(list_options(list_params, fields))
+    query = filter_sources(query, source_filter)
+    return read_source_page(lambda q: q.all(), query, list_params)
+
+
+def read_source_page(read: Callable[[Any], list], query, list_params: ListQueryParams) -> list:
+    """
+    The rows of a page of a query over sources, read with read(statement). The page takes a
+    second seek when it continues into the other NULL segment of the sort key.
+    """
+    rows = read(keyset_paginate(query, list_params, SORT_KEYS, models.Source.id))
+    rest = keyset_next_segment(query, list_params, SORT_KEYS, models.Source.id, len(rows))
+    return rows if rest is None else rows + read(rest)
+
+
+def source_page(sources: List[models.Source], list_params: ListQueryParams, fields: Sequence[str]) -> SourcePage:
+    model = sparse_model(schemas.ListSource, tuple(fields))
+    return SourcePage(
+        [model.from_orm(source) for source in sources],
+        list_params.next_cursor(sources),
+        *page_validators(sources, fields)
+    )
+
+
+def source_page_key(list_params: ListQueryParams, source_filter: filters.SourceFilter,
+                    fields: Sequence[str]) -> tuple:
+    return cache_key(list_params, source_filter), tuple(fields)
+
+
+def source_page_validators_statement(source_filter: filters.SourceFilter):
+    """
+    Select only the id and updated of the sources get_sources lists, to be paged like them
+    """
+    return filter_sources(select(models.Source.id, models.Source.updated), source_filter)
+
+
+def get_source_page_validators(db: Session, list_params: ListQueryParams, source_filter: filters.SourceFilter,
+                               fields: Sequence[str] = LIST_COLUMNS) -> Tuple[str, Optional[datetime]]:
+    """
+    ETag and Last-Modified of the page get_sources_cached returns, without building it when it
+    is not cached, so conditional requests for an unchanged page skip loading and serializing it
+    """
+    page = source_list_cache.get(source_page_key(list_params, source_filter, fields))
+    if page is not None:
+        return page.etag, page.last_modified
+    stmt = source_page_validators_statement(source_filter)
+    return page_validators(read_source_page(lambda s: db.execute(s).all(), stmt, list_params), fields)
+
+
+def get_sources_cached(db: Session, list_params: ListQueryParams, source_filter: filters.SourceFilter,
+                       fields: Sequence[str] = LIST_COLUMNS) -> SourcePage:
+    """
+    A page of get_sources, served from source_list_cache when possible
+    """
+    key = source_page_key(list_params, source_filter, fields)
+    page = source_list_cache.get(key)
+    if page is None:
+        page = source_page(get_sources(db, list_params, source_filter, fields), list_params, fields)
+        source_list_cache.set(key, page)
+    return page
+
+
+def iter_source_partitions(db: Session, list_params: ListQueryParams, source_filter: filters.SourceFilter,
+                           columns: Sequence[str] = LIST_COLUMNS) -> Iterator[List[Row]]:
+    """
+    Same listing as get_sources, but as lists of plain Core rows of the named SOURCE_COLUMNS read
+    through a server side cursor, so memory use does not grow with the size of the result
+    """
+    stmt = filter_sources(select(*(SOURCE_COLUMNS[name] for name in columns)), source_filter)
+
+    def partitions(statement) -> Iterator[List[Row]]:
+        result = db.execute(statement.execution_options(stream_results=True))
+        return result.partitions(settings.stream_batch_size)
+
+    count = 0
+    for partition in partitions(keyset_paginate(stmt, list_params, SORT_KEYS, models.Source.id)):
+        count += len(partition)
+        yield partition
+    rest = keyset_next_segment(stmt, list_params, SORT_KEYS, models.Source.id, count)
+    if rest is not None:
+        yield from partitions(rest)
+
+
+def changed_rows(db: Session, model, after: Optional[Tuple[datetime, int]], horizon: datetime, limit: int,
+                 *options) -> list:
+    """
+    Rows of model past the (updated, id) position `after` and updated before horizon, in (updated, id) order
+    """
+    query = db.query(model).options(*options).filter(model.updated < horizon)
+    if after is not None:
+        query = query.filter(tuple_(model.updated, model.id) > tuple_(*after))
+    return query.order_by(model.updated, model.id).limit(limit).all()
+
+
+def get_changes(db: Session, params: filters.ChangeFeedParams) -> Dict[str, Any]:
+    """
+    Sources and comments updated since the checkpoint of params, at most params.limit of each, with
+    the checkpoint to resume from. Both feeds seek their (updated, id) index, so a call costs the
+    number of changes returned rather than the size of the catalog.
+    """
+    positions = params.positions(CHANGE_FEEDS)
+    horizon = datetime.utcnow() - timedelta(seconds=settings.change_feed_lag)
+    changes = {
+        'sources': changed_rows(
+            db, models.Source, positions['sources'], horizon, params.limit, load_columns(LIST_COLUMNS, 'updated')
+        ),
+        'comments': changed_rows(db, models.Comment, positions['comments'], horizon, params.limit),
+    }
+    for feed, rows in changes.items():
+        if rows:
+            positions[feed] = (rows[-1].updated, rows[-1].id)
+    return dict(
+        changes,
+        cursor=params.next_cursor(positions),
+        more=any(len(rows) == params.limit for rows in changes.values()),
+    )
+
+
+def autocomplete(db: Session, q: str, limit: int) -> List[Row]:
+    """
+    (id, name) of sources whose name starts with q, topped up with names similar to q
+    when there are fewer than limit prefix matches. Both lookups use the trigram index.
+    """
+    columns = (models.Source.id, models.Source.name)
+    matches = db.query(*columns).filter(
+        models.Source.name.startswith(q, autoescape=True)
+    ).order_by(models.Source.name).limit(limit).all()
+
+    if len(matches) < limit:
+        # The pg_trgm similarity operator %, doubled for the driver's paramstyle
+        matches += db.query(*columns).filter(
+            models.Source.name.op('%%')(q),
+            models.Source.id.notin_([match.id for match in matches]),
+        ).order_by(func.similarity(models.Source.name, q).desc()).limit(limit - len(matches)).all()
+
+    return matches
+
+
+def nearest_sources(db: Session, ra: float, dec: float, k: int) -> List[Dict[str, Any]]:
+    """
+    The k sources closest to ra/dec, nearest first with their separation in degrees. Ordering by the
+    <-> distance operator alone lets the GiST index on location return them without a radius, a
+    second sort key would prevent that before PostgreSQL 13, so ties are broken by id here.
+    """
+    columns = [SOURCE_COLUMNS[name] for name in LIST_COLUMNS]
+    if use_memory_index():
+        ids, separations = memory_index.nearest(ra, dec, k)
+        rows = {row.id: row for row in db.execute(select(*columns).where(models.Source.id == any_(id_array(ids))))}
+        return [
+            dict(rows[i]._mapping, separation=separation)
+            for i, separation in zip(ids.tolist(), separations.tolist()) if i in rows
+        ]
+
+    point = func.ST_GeogFromText(wkt_point(ra, dec, settings.srid))
+    distance = models.Source.location.op('<->', return_type=Float)(point)
+    rows = db.execute(
+        select(*columns, (distance / degrees_to_meters(1)).label('separation'))
+        .order_by(distance)
+        .limit(k)
+    )
+    return sorted((dict(row._mapping) for row in rows), key=itemgetter('separation', 'id'))
+
+
+def cone_search(db: Session, cones: List[schemas.Cone]) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Resolve many cones with one spatial join, yielding (cone id, matching sources) in input order.
+    Rows are read from a server side cursor so results are produced as the database returns them.
+    """
+    cone = text(
+        'SELECT c.cone_id, c.ordinal, c.radius, '
+        'CAST(ST_SetSRID(ST_MakePoint(c.ra, c.dec), :srid) AS geography) AS location '
+        'FROM unnest(CAST(:ids AS text[]), CAST(:ras AS float8[]), CAST(:decs AS float8[]), CAST(:radii AS float8[])) '
+        'WITH ORDINALITY AS c(cone_id, ra, dec, radius, ordinal)'
+    ).bindparams(
+        srid=settings.srid,
+        ids=[c.id for c in cones],
+        ras=[c.ra for c in cones],
+        decs=[c.dec for c in cones],
+        radii=[degrees_to_meters(c.radius) for c in cones],
+    ).columns(
+        column('cone_id', String), column('ordinal', Integer), column('radius', Float), column('location')
+    ).subquery('cone')
+
+    stmt = select(
+        cone.c.ordinal,
+        cone.c.cone_id,
+        models.Source.id,
+        models.Source.name,
+        models.Source.ra,
+        models.Source.dec,
+        models.Source.data,
+    ).select_from(
+        cone.outerjoin(models.Source, models.Source.location.ST_DWithin(cone.c.location, cone.c.radius))
+    ).order_by(cone.c.ordinal, models.Source.id).execution_options(stream_results=True)
+
+    rows = db.execute(stmt)
+    for (_, cone_id), matches in groupby(rows, key=lambda row: (row.ordinal, row.cone_id)):
+        yield cone_id, [
+            {'id': row.id, 'name': row.name, 'ra': row.ra, 'dec': row.dec, 'data': row.data}
+            for row in matches if row.id is not None
+        ]
+
+
+def density_increment_statement(healpix: Iterable[int]):
+    """
+    Upsert adding sources, given by their Source.healpix, to the counts of their SourceDensity tiles.
+    Tiles are written in pixel order so concurrent increments cannot deadlock.
+    """
+    shift = 2 * (settings.healpix_order - settings.density_order)
+    counts = Counter(pixel >> shift for pixel in healpix)
+    now = datetime.utcnow()
+    stmt = insert(models.SourceDensity).values([
+        {'pixel': pixel, 'count': count, 'created': now, 'updated': now} for pixel, count in sorted(counts.items())
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=[models.SourceDensity.pixel],
+        set_={'count': models.SourceDensity.count + stmt.excluded.count, 'updated': stmt.excluded.updated}
+    )
+
+
+def increment_density(db: Session, healpix: Sequence[int]):
+    if healpix:
+        db.execute(density_increment_statement(healpix))
+
+
+def get_density(db: Session, order: int) -> List[Dict[str, int]]:
+    """
+    Number of sources in every non empty pixel at `order`, summed from the SourceDensity tiles
+    """
+    pixel = models.SourceDensity.pixel.op('>>')(2 * (settings.density_order - order)).label('pixel')
+    count = cast(func.sum(models.SourceDensity.count), BigInteger).label('count')
+    stmt = select(pixel, count).group_by(pixel).order_by(pixel)
+    return [dict(tile) for tile in db.execute(stmt).mappings()]
+
+
+def source_count_statement(source_filter: filters.SourceFilter):
+    """
+    Select the number of sources matching source_filter. Pixels lying fully inside the cone are
+    counted from the SourceDensity tiles, only sources in pixels crossing its edge are counted
+    one by one. Other filters fall back to counting source.
+    """
+    exact = (source_filter.box, source_filter.polygon, source_filter.data)
+    if source_filter.name_contains is not None or any(exact):
+        return filter_sources(select(func.count()).select_from(models.Source), source_filter)
+
+    tiles = select(func.coalesce(func.sum(models.SourceDensity.count), 0))
+    if not source_filter.cone:
+        return tiles
+
+    ra, dec, radius = source_filter.cone
+    inside, edge = [], []
+    for depth, pixel, fully_inside in cover_cone(settings.density_order, ra, dec, radius, DENSITY_MAX_PIXELS):
+        shift = 2 * (settings.density_order - depth)
+        (inside if fully_inside else edge).append((pixel << shift, (pixel + 1) << shift))
+
+    tile_count = tiles.where(or_(
+        *(models.SourceDensity.pixel.between(start, stop - 1) for start, stop in merge_ranges(inside))
+    )).scalar_subquery() if inside else 0
+
+    shift = 2 * (settings.healpix_order - settings.density_order)
+    edge_count = select(func.count()).select_from(models.Source).where(
+        or_(*(
+            models.Source.healpix.between(start << shift, (stop << shift) - 1) for start, stop in merge_ranges(edge)
+        )),
+        models.Source.location.ST_DWithin(wkt_point(ra, dec, settings.srid), degrees_to_meters(radius))
+    ).scalar_subquery() if edge else 0
+
+    return select(literal(0) + tile_count + edge_count)
+
 
-    return query.order_by(list_params.order_by).offset(list_params.skip).limit(list_params.limit).all()
+def count_sources(db: Session, source_filter: filters.SourceFilter) -> int:
+    return int(db.execute(source_count_statement(source_filter)).scalar())
 
 
 def create_source(db: Session, source: schemas.CreateSource) -> models.Source:
     db_source = models.Source(**source.dict())
     db.add(db_source)
+    increment_density(db, [db_source.healpix])
+    db.flush()
+    db.execute(source_event_statement(db_source))
     db.commit()
+    source_list_cache.clear()
     db.refresh(db_source)
+    index_sources([db_source])
     return db_source
 
 
 def create_comment(db: Session, comment: schemas.Comment, source_id: int) -> models.Comment:
     db_comment = models.Comment(**comment.dict(), source_id=source_id)
     db.add(db_comment)
+    db.flush()
+    db.execute(comment_event_statement(db_comment))
     db.commit()
+    source_cache.pop(source_id)
     db.refresh(db_comment)
     return db_comment
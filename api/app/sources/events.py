@@ -0,0 +1,184 @@
+"""
+Live events of new sources and comments, pushed to clients as Server-Sent Events.
+
+create_source and create_comment send a NOTIFY on EVENTS_CHANNEL in their transaction,
+so events are only delivered once the rows are committed. Each worker holds a single
+LISTEN connection, opened when its first client subscribes, and fans every event out to
+the queues of its subscribers. A subscriber which falls more than settings.event_queue_size
+events behind is disconnected, and can catch up through the change feed.
+"""
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+
+import asyncpg
+from sqlalchemy import String, cast, func, literal_column, select
+from sqlalchemy.engine import make_url
+
+from . import models
+from ..config import settings
+from ..util.calc import angular_separation
+
+logger = logging.getLogger('app')
+
+EVENTS_CHANNEL = 'source_events'
+EVENT_STREAM_MEDIA_TYPE = 'text/event-stream'
+EVENT_TYPES = ('source', 'comment')
+# Comma separated event types
+EVENT_TYPES_REGEX = r'^(source|comment)(,(source|comment))*$'
+
+
+def _json_object(**values):
+    """
+    json_build_object of SQL expressions. Keys are inlined, asyncpg cannot infer the type of
+    parameters of a function taking "any".
+    """
+    pairs = ((literal_column(f"'{key}'"), value) for key, value in values.items())
+    return func.json_build_object(*(item for pair in pairs for item in pair))
+
+
+def listen_dsn() -> str:
+    """
+    The database of the async engine, or of the primary, as a plain postgresql:// DSN. asyncpg
+    rejects the driver qualified URLs SQLAlchemy takes.
+    """
+    url = make_url(settings.async_db_string or settings.db_string).set(drivername='postgresql')
+    return url.render_as_string(hide_password=False)
+
+
+def _notify(payload):
+    return select(func.pg_notify(EVENTS_CHANNEL, cast(payload, String)))
+
+
+def source_event_statement(source: models.Source):
+    """
+    Notify subscribers of a new source, execute after flushing it. The name is left out as
+    payloads are limited to 8000 bytes, subscribers fetch the source for the rest.
+    """
+    return _notify(_json_object(
+        event=literal_column("'source'"),
+        id=models.Source.id,
+        ra=models.Source.ra,
+        dec=models.Source.dec,
+    )).where(models.Source.id == source.id)
+
+
+def comment_event_statement(comment: models.Comment):
+    """
+    Notify subscribers of a new comment with the position of its source, execute after flushing it.
+    The content is left out as payloads are limited to 8000 bytes.
+    """
+    return _notify(_json_object(
+        event=literal_column("'comment'"),
+        id=models.Comment.id,
+        source_id=models.Comment.source_id,
+        ra=models.Source.ra,
+        dec=models.Source.dec,
+    )).select_from(models.Comment).join(models.Source).where(models.Comment.id == comment.id)
+
+
+class Subscription:
+    """
+    The queue of events of one client, optionally limited to a cone
+    """
+    def __init__(self, event_types: Tuple[str, ...] = EVENT_TYPES, cone: tuple = ()):
+        self.event_types = event_types
+        self.cone = cone
+        self.queue: asyncio.Queue = asyncio.Queue(settings.event_queue_size)
+        self.overflowed = False
+
+    def wants(self, event: Dict[str, Any]) -> bool:
+        if event['event'] not in self.event_types:
+            return False
+        if not self.cone:
+            return True
+        ra, dec, radius = self.cone
+        return float(angular_separation(ra, dec, event['ra'], event['dec'])) <= radius
+
+    def put(self, event: Dict[str, Any]):
+        if self.overflowed or not self.wants(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            # Wake up the stream so it ends
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class EventBroker:
+    """
+    Fans the notifications of one LISTEN connection out to the subscriptions of this worker
+    """
+    def __init__(self, channel: str = EVENTS_CHANNEL):
+        self.channel = channel
+        self.subscriptions: Set[Subscription] = set()
+        self._connection: Optional[asyncpg.Connection] = None
+        # Created on first use, in the event loop of the server
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def listen(self):
+        """
+        Open the LISTEN connection, or open it again if it was lost
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._connection is not None and not self._connection.is_closed():
+                return
+            self._connection = await asyncpg.connect(listen_dsn())
+            await self._connection.add_listener(self.channel, self._notify)
+
+    async def stop(self):
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+    def _notify(self, connection, pid: int, channel: str, payload: str):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning(f'Ignoring malformed event on {channel}: {payload!r}')
+            return
+        for subscription in list(self.subscriptions):
+            subscription.put(event)
+
+    async def events(self, subscription: Subscription) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yield the events of subscription as they arrive, and None after every
+        settings.event_keepalive seconds without one. Ends if the subscription overflows.
+        """
+        await self.listen()
+        self.subscriptions.add(subscription)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), settings.event_keepalive)
+                except asyncio.TimeoutError:
+                    await self.listen()
+                    yield None
+                    continue
+                if subscription.overflowed:
+                    return
+                yield event
+        finally:
+            self.subscriptions.discard(subscription)
+
+
+def format_event(event: Optional[Dict[str, Any]]) -> str:
+    """
+    A Server-Sent Event message, or a comment line keeping the connection open for None
+    """
+    if event is None:
+        return ': keepalive\n\n'
+    return f'event: {event["event"]}\ndata: {json.dumps(event)}\n\n'
+
+
+async def event_stream(subscription: Subscription) -> AsyncIterator[str]:
+    async for event in event_broker.events(subscription):
+        yield format_event(event)
+
+
+event_broker = EventBroker()
@@ -1,6 +1,42 @@
-from fastapi import Query
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+import json
+import math
+from fastapi import HTTPException, Query, status
 from pydantic import BaseModel
 
+from ..config import settings
+from ..util.web import decode_cursor, encode_cursor
+
+# Comma separated numbers
+NUMBERS_REGEX = r'^[-+.\deE]+(,[-+.\deE]+)*$'
+# Comparisons accepted by SourceFilter.data
+DATA_OPERATORS = ('eq', 'lt', 'le', 'gt', 'ge', 'exists')
+
+
+class _NonFinite(Exception):
+    """
+    A JSON number jsonb cannot hold: NaN, Infinity or a float overflowing to infinity
+    """
+
+
+def _reject_constant(text: str):
+    raise _NonFinite(text)
+
+
+def _finite_float(text: str) -> float:
+    number = float(text)
+    if not math.isfinite(number):
+        raise _NonFinite(text)
+    return number
+
+
+def _numbers(value: str, name: str) -> List[float]:
+    try:
+        return [float(number) for number in value.split(',')]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f'Invalid {name}')
+
 
 class SourceFilter(BaseModel):
     """
@@ -10,9 +46,118 @@ class SourceFilter(BaseModel):
     cone_ra: float = Query(None, ge=-360, le=360)
     cone_dec: float = Query(None, ge=-90, le=90)
     cone_radius: float = Query(None)
+    # ra_min,dec_min,ra_max,dec_max, wrapping through RA 0 when ra_min > ra_max once both are in [0, 360)
+    box: str = Query(None, regex=NUMBERS_REGEX)
+    # ra1,dec1,ra2,dec2,ra3,dec3,... with edges along great circles
+    polygon: str = Query(None, regex=NUMBERS_REGEX)
+    # Comma separated conditions on data as key:operator:value or key:exists. Nested keys are
+    # separated by dots and values are read as JSON when possible, e.g. type:eq:galaxy,phot.g:lt:18
+    data: str = Query(None)
 
     @property
     def cone(self) -> tuple:
         if all((self.cone_ra, self.cone_dec, self.cone_radius)):
             return (self.cone_ra, self.cone_dec, self.cone_radius)
         return ()
+
+    @property
+    def box_bounds(self) -> tuple:
+        if not self.box:
+            return ()
+        values = _numbers(self.box, 'box')
+        if len(values) != 4:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='box must be ra_min,dec_min,ra_max,dec_max'
+            )
+        ra_min, dec_min, ra_max, dec_max = values
+        if not (-360 <= ra_min <= 360 and -360 <= ra_max <= 360 and -90 <= dec_min < dec_max <= 90):
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail='box needs -360 <= ra <= 360 and -90 <= dec_min < dec_max <= 90'
+            )
+        # RA wrapped to [0, 360), unless the box spans every RA
+        if ra_max - ra_min >= 360:
+            return 0.0, dec_min, 360.0, dec_max
+        return ra_min % 360, dec_min, ra_max % 360, dec_max
+
+    @property
+    def polygon_vertices(self) -> List[Tuple[float, float]]:
+        if not self.polygon:
+            return []
+        values = _numbers(self.polygon, 'polygon')
+        vertices = list(zip(values[::2], values[1::2]))
+        if len(values) % 2 or len(vertices) < 3:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='polygon needs at least 3 ra,dec vertices'
+            )
+        if not all(-360 <= ra <= 360 and -90 <= dec <= 90 for ra, dec in vertices):
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail='polygon needs -360 <= ra <= 360 and -90 <= dec <= 90'
+            )
+        return vertices
+
+    @property
+    def data_conditions(self) -> List[Tuple[List[str], str, Any]]:
+        """
+        (key path, operator, value) of each data condition
+        """
+        conditions = []
+        for condition in self.data.split(',') if self.data else []:
+            key, _, rest = condition.partition(':')
+            operator, _, value = rest.partition(':')
+            if not key or operator not in DATA_OPERATORS or (operator == 'exists') != (value == ''):
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail=f'Invalid data condition {condition!r}, expected key:{"|".join(DATA_OPERATORS)}:value'
+                )
+            try:
+                value = json.loads(value, parse_constant=_reject_constant, parse_float=_finite_float)
+            except _NonFinite:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail=f'Invalid data condition {condition!r}, numbers must be finite'
+                )
+            except ValueError:
+                pass
+            comparable = isinstance(value, (int, float, str)) and not isinstance(value, bool)
+            if operator not in ('eq', 'exists') and not comparable:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail=f'Invalid data condition {condition!r}, {operator} needs a number or a string'
+                )
+            conditions.append((key.split('.'), operator, value))
+        return conditions
+
+
+class ChangeFeedParams(BaseModel):
+    """
+    Query params of the change feed. `cursor` is the checkpoint returned by the previous call,
+    `since` starts a feed from a time instead of from the beginning.
+    """
+    cursor: str = Query(None)
+    since: datetime = Query(None)
+    limit: int = Query(100, ge=1, le=settings.change_feed_max_limit)
+
+    def positions(self, feeds: List[str]) -> Dict[str, Optional[Tuple[datetime, int]]]:
+        """
+        The (updated, id) of the last row seen of each feed, None for a feed read from the start
+        """
+        if not self.cursor:
+            return {feed: (self.since, 0) if self.since else None for feed in feeds}
+        try:
+            values = decode_cursor(self.cursor)
+            if len(values) != len(feeds):
+                raise ValueError('Wrong number of feeds')
+            return {
+                feed: (datetime.fromisoformat(position[0]), int(position[1])) if position else None
+                for feed, position in zip(feeds, values)
+            }
+        except (TypeError, ValueError, IndexError):
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Invalid cursor')
+
+    @staticmethod
+    def next_cursor(positions: Dict[str, Optional[Tuple[datetime, int]]]) -> str:
+        return encode_cursor([
+            [position[0].isoformat(), position[1]] if position else None for position in positions.values()
+        ])
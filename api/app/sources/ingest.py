@@ -0,0 +1,211 @@
+"""
+Bulk loading of Sources using PostgreSQL COPY.
+
+Records are read as NDJSON (one CreateSource object per line) or CSV with a
+header row of name,ra,dec[,data] where data is a JSON encoded string.
+Records are expected to fit on a single line.
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from datetime import datetime
+from enum import Enum
+import argparse
+import csv
+import io
+import itertools
+import json
+import sys
+
+import numpy as np
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from . import schemas
+from .crud import increment_density, source_list_cache
+from .spatial import memory_index, use_memory_index
+from ..config import settings
+from ..util.calc import ewkb_points, normalize_ra
+from ..util.healpix import ang2pix_array
+from ..util.web import undecodable
+
+COPY_COLUMNS = ('created', 'updated', 'name', 'ra', 'dec', 'location', 'healpix', 'data')
+
+
+class Format(str, Enum):
+    ndjson = 'ndjson'
+    csv = 'csv'
+
+
+def format_for_content_type(content_type: Optional[str]) -> Format:
+    if content_type and content_type.split(';')[0].strip() in ('text/csv', 'application/csv'):
+        return Format.csv
+    return Format.ndjson
+
+
+def copy_value(value: Any) -> str:
+    """
+    Escape a value for the PostgreSQL COPY text format
+    """
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_sources(db: Session, sources: List[schemas.CreateSource]) -> int:
+    """
+    Write validated sources to the source table with a single COPY and add them to the density tiles
+    """
+    if not sources:
+        return 0
+
+    now = datetime.utcnow().isoformat()
+    ra = normalize_ra([source.ra for source in sources])
+    dec = np.array([source.dec for source in sources])
+    healpix = ang2pix_array(settings.healpix_order, ra, dec)
+
+    # Rows are joined from whole columns, only names and data need escaping one by one
+    columns = (
+        itertools.repeat(now),
+        itertools.repeat(now),
+        [copy_value(source.name) for source in sources],
+        map(repr, ra.tolist()),
+        map(repr, dec.tolist()),
+        ewkb_points(ra, dec, settings.srid).astype(str),
+        healpix.astype(str),
+        [copy_value(None if source.data is None else json.dumps(source.data)) for source in sources],
+    )
+    buffer = io.StringIO('\n'.join(map('\t'.join, zip(*columns))) + '\n')
+
+    cursor = db.connection().connection.cursor()
+    cursor.copy_expert(f'COPY source ({", ".join(COPY_COLUMNS)}) FROM STDIN', buffer)
+    increment_density(db, healpix.tolist())
+    return len(sources)
+
+
+class RecordParser:
+    """
+    Parses lines into record dicts. The first CSV line is consumed as the header, and a
+    CSV data column holds a JSON encoded string.
+    """
+    def __init__(self, fmt: Format = Format.ndjson):
+        self.format = fmt
+        self.header: Optional[List[str]] = None
+
+    @property
+    def expects_header(self) -> bool:
+        return self.format == Format.csv and self.header is None
+
+    def parse(self, line: str) -> Optional[Dict[str, Any]]:
+        if undecodable(line):
+            raise ValueError('Line is not valid UTF-8')
+        if self.format == Format.ndjson:
+            return json.loads(line)
+
+        values = next(csv.reader([line]))
+        if self.header is None:
+            self.header = [value.strip() for value in values]
+            return None
+        if len(values) != len(self.header):
+            raise ValueError(f'Expected {len(self.header)} columns, got {len(values)}')
+        record = dict(zip(self.header, values))
+        if record.get('data'):
+            record['data'] = json.loads(record['data'])
+        else:
+            record.pop('data', None)
+        return record
+
+
+class SourceLoader:
+    """
+    Validates batches of raw lines as CreateSource records and loads the
+    valid ones with COPY, committing once per batch. Only the current
+    batch is held in memory; the running totals are kept in `result`,
+    which lists at most ingest_max_batch_errors errors per batch and
+    ingest_max_errors in all.
+    """
+    def __init__(self, db: Session, fmt: Format = Format.ndjson):
+        self.db = db
+        self.parser = RecordParser(fmt)
+        self.result = schemas.IngestResult()
+        self.listed_errors = 0
+
+    def load_batch(self, lines: List[Tuple[int, str]]) -> schemas.IngestBatch:
+        sources = []
+        errors = []
+        received = 0
+        rejected = 0
+        max_errors = min(settings.ingest_max_batch_errors, settings.ingest_max_errors - self.listed_errors)
+        for line_number, line in lines:
+            header = self.parser.expects_header
+            if not header:
+                received += 1
+            try:
+                record = self.parser.parse(line)
+                if not header:
+                    sources.append(schemas.CreateSource(**record))
+            except (ValueError, TypeError, ValidationError) as exc:
+                rejected += 1
+                if len(errors) < max_errors:
+                    errors.append(schemas.IngestError(line=line_number, error=str(exc)))
+
+        inserted = copy_sources(self.db, sources)
+        self.db.commit()
+        source_list_cache.clear()
+        if use_memory_index():
+            memory_index.catch_up(self.db)
+
+        batch = schemas.IngestBatch(
+            batch=len(self.result.batches) + 1,
+            received=received,
+            inserted=inserted,
+            rejected=rejected,
+            errors=errors
+        )
+        self.result.batches.append(batch)
+        self.result.received += batch.received
+        self.result.inserted += batch.inserted
+        self.result.rejected += batch.rejected
+        self.listed_errors += len(errors)
+        return batch
+
+
+def batched_lines(lines: Iterable[str], size: int) -> Iterator[List[Tuple[int, str]]]:
+    numbered = ((number, line.rstrip('\r\n')) for number, line in enumerate(lines, start=1))
+    numbered = (item for item in numbered if item[1].strip())
+    while True:
+        batch = list(itertools.islice(numbered, size))
+        if not batch:
+            return
+        yield batch
+
+
+def main(argv: Optional[List[str]] = None):
+    from ..database import SessionLocal
+
+    parser = argparse.ArgumentParser(description='Bulk load sources from an NDJSON or CSV file.')
+    parser.add_argument('path', help='File to load, or - for stdin')
+    parser.add_argument('--format', choices=[f.value for f in Format], default=None)
+    parser.add_argument('--batch-size', type=int, default=settings.ingest_batch_size)
+    args = parser.parse_args(argv)
+
+    fmt = Format(args.format) if args.format else (Format.csv if args.path.endswith('.csv') else Format.ndjson)
+    stream = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8', errors='surrogateescape')
+    db = SessionLocal()
+    try:
+        loader = SourceLoader(db, fmt)
+        for lines in batched_lines(stream, args.batch_size):
+            batch = loader.load_batch(lines)
+            print(f'batch {batch.batch}: received {batch.received}, inserted {batch.inserted}, errors {batch.rejected}')
+            for error in batch.errors:
+                print(f'  line {error.line}: {error.error}', file=sys.stderr)
+            if batch.rejected > len(batch.errors):
+                print(f'  {batch.rejected - len(batch.errors)} more errors not listed', file=sys.stderr)
+        result = loader.result
+        print(f'total: received {result.received}, inserted {result.inserted}, errors {result.rejected}')
+    finally:
+        db.close()
+        if stream is not sys.stdin:
+            stream.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,44 +1,71 @@
-from sqlalchemy import Column, String, JSON, Integer
+from sqlalchemy import BigInteger, Column, Float, Index, String, Integer
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
-from geoalchemy2 import Geography, shape
+from geoalchemy2 import Geography
 from sqlalchemy.sql.schema import ForeignKey
 
 from ..database import Base
 from ..config import settings
 from ..util.calc import wkt_point
+from ..util.healpix import ang2pix
 
 
 class Source(Base):
     name = Column(String, index=True)
-    location = Column(Geography('POINT', srid=settings.srid), nullable=False, index=True)
-    data = Column(JSON)
+    location = Column(Geography('POINT', srid=settings.srid, spatial_index=False), nullable=False)
+    # Copies of the coordinates of location, so reading them never decodes the geography.
+    # ra is normalized to [0, 360).
+    ra = Column(Float, nullable=False)
+    dec = Column(Float, nullable=False)
+    # Nested HEALPix pixel of location at settings.healpix_order
+    healpix = Column(BigInteger, nullable=False, index=True)
+    data = Column(JSONB)
 
     comments = relationship('Comment', back_populates='source')
 
+    __table_args__ = (
+        # Spatial index, also serves nearest neighbour ordering with <->
+        Index('ix_source_location', 'location', postgresql_using='gist'),
+        # Keyset pagination indexes, see crud.SORT_KEYS
+        Index('ix_source_name_id', 'name', 'id'),
+        Index('ix_source_created_id', 'created', 'id'),
+        Index('ix_source_updated_id', 'updated', 'id'),
+        # Substring, prefix and similarity searches on name, requires the pg_trgm extension
+        Index('ix_source_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        # Containment, key existence and jsonpath filters on data, see filters.SourceFilter.data
+        Index('ix_source_data', 'data', postgresql_using='gin'),
+    )
+
     def __init__(self, *args, **kwargs):
         """
-        Convert the ra/dec fields from the schema into the PostGIS text representation
+        Derive the PostGIS text representation and the HEALPix index from the ra/dec fields of the schema
         """
-        ra = kwargs.pop('ra')
-        dec = kwargs.pop('dec')
+        ra = kwargs['ra'] = kwargs['ra'] % 360
+        dec = kwargs['dec']
         kwargs['location'] = wkt_point(ra, dec, settings.srid)
+        kwargs['healpix'] = ang2pix(settings.healpix_order, ra, dec)
 
         return super().__init__(*args, **kwargs)
 
-    @property
-    def ra(self):
-        ra = shape.to_shape(self.location).x
-        if ra < 0:
-            ra = ra + 360
-        return ra
-
-    @property
-    def dec(self):
-        return shape.to_shape(self.location).y
-
 
 class Comment(Base):
     content = Column(String)
     source_id = Column(Integer, ForeignKey('source.id'))
 
     source = relationship('Source', back_populates='comments')
+
+    __table_args__ = (
+        # Keyset pagination of the comments of a source, see crud.COMMENT_SORT_KEYS
+        Index('ix_comment_source_id_id', 'source_id', 'id'),
+        # Change feed, see crud.get_changes
+        Index('ix_comment_updated_id', 'updated', 'id'),
+    )
+
+
+class SourceDensity(Base):
+    """
+    Number of sources in each nested HEALPix pixel at settings.density_order, updated in the
+    transaction that inserts the sources, so densities and region counts never scan source
+    """
+    pixel = Column(BigInteger, nullable=False, unique=True)
+    count = Column(BigInteger, nullable=False)
@@ -1,5 +1,9 @@
-from typing import List, Any
-from pydantic import BaseModel
+from typing import List, Any, Optional
+from datetime import datetime
+import math
+from pydantic import BaseModel, Field, conlist, validator
+
+from ..config import settings
 
 
 class Comment(BaseModel):
@@ -9,6 +13,14 @@ class Comment(BaseModel):
         orm_mode = True
 
 
+class ListComment(Comment):
+    """
+    Fields which should be displayed when listing comments
+    """
+    id: int
+    created: datetime
+
+
 class BaseSource(BaseModel):
     name: str
     ra: float
@@ -23,12 +35,24 @@ class CreateSource(BaseSource):
     """
     Fields which should be required for creating a source
     """
-    pass
+    ra: float = Field(..., ge=-360, le=360)
+    dec: float = Field(..., ge=-90, le=90)
+
+    @validator('ra', 'dec', pre=True)
+    def finite(cls, value):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            # Left to the float validation
+            return value
+        if not math.isfinite(number):
+            raise ValueError('must be a finite number')
+        return value
 
 
 class Source(BaseSource):
     """
-    Fields for displaying a single Source
+    Fields for displaying a single Source, with only its latest comments
     """
     id: int
     comments: List[Comment] = []
@@ -39,3 +63,127 @@ class ListSource(BaseSource):
     Fields which should be displayed when listing sources
     """
     id: int
+
+
+class NearestSource(ListSource):
+    """
+    A source with its angular separation in degrees from the search position
+    """
+    separation: float
+
+
+class ChangedSource(ListSource):
+    updated: datetime
+
+
+class ChangedComment(ListComment):
+    source_id: int
+    updated: datetime
+
+
+class Changes(BaseModel):
+    """
+    Sources and comments updated since a change feed checkpoint, in (updated, id) order.
+    `cursor` is the checkpoint of the next call, `more` tells whether it has changes ready.
+    """
+    sources: List[ChangedSource]
+    comments: List[ChangedComment]
+    cursor: str
+    more: bool
+
+
+class SourceName(BaseModel):
+    """
+    Minimal fields for typeahead suggestions
+    """
+    id: int
+    name: str
+
+    class Config:
+        orm_mode = True
+
+
+class DensityTile(BaseModel):
+    """
+    Number of sources in a nested HEALPix pixel
+    """
+    pixel: int
+    count: int
+
+
+class SourceCount(BaseModel):
+    count: int
+
+
+class IngestError(BaseModel):
+    """
+    A single record rejected during a bulk ingest
+    """
+    line: int
+    error: str
+
+
+class IngestBatch(BaseModel):
+    """
+    Outcome of loading one batch of a bulk ingest. `rejected` counts every record rejected,
+    `errors` lists the first of them up to the configured limits.
+    """
+    batch: int
+    received: int
+    inserted: int
+    rejected: int = 0
+    errors: List[IngestError] = []
+
+
+class IngestResult(BaseModel):
+    received: int = 0
+    inserted: int = 0
+    rejected: int = 0
+    batches: List[IngestBatch] = []
+
+
+class Cone(BaseModel):
+    id: str
+    ra: float = Field(..., ge=-360, le=360)
+    dec: float = Field(..., ge=-90, le=90)
+    radius: float = Field(..., gt=0)
+
+
+class ConeSearch(BaseModel):
+    """
+    A batch of cones to be resolved in a single query
+    """
+    cones: conlist(Cone, min_items=1, max_items=settings.cone_search_max_cones)
+
+
+class ConeMatches(BaseModel):
+    """
+    Sources matching one cone of a ConeSearch, streamed as one NDJSON line per cone
+    """
+    id: str
+    sources: List[ListSource]
+
+
+class CrossmatchPosition(BaseModel):
+    """
+    A position of an uploaded catalog, radius (degrees) defaults to the radius of the request
+    """
+    id: str
+    ra: float = Field(..., ge=-360, le=360)
+    dec: float = Field(..., ge=-90, le=90)
+    radius: float = Field(None, gt=0, le=settings.crossmatch_max_radius)
+
+    @validator('radius', pre=True)
+    def empty_radius(cls, value):
+        # An empty CSV cell
+        return None if value == '' else value
+
+
+class CrossmatchMatch(BaseModel):
+    """
+    A source matched to an uploaded position, streamed as one NDJSON line per match.
+    source and separation are null for positions without a match.
+    """
+    id: str
+    source: Optional[ListSource]
+    separation: Optional[float]
@@ -0,0 +1,261 @@
+"""
+In-process spatial index of Source positions, used for cone and nearest neighbour
+searches when settings.source_index_engine is 'memory'.
+
+Positions are kept as unit vectors in arrays sorted by their nested HEALPix pixel
+(Source.healpix), so the sources in a cone are found by binary searching the pixel
+ranges covering it and checking the exact distance of the candidates only. Rows
+added since the last merge are kept in a small unsorted buffer which is scanned
+in full. Sources are never removed, as the API cannot delete them.
+
+The index is loaded at startup, then a background thread catches up with the
+rows inserted by every process each settings.memory_index_refresh seconds.
+Rows created by this process are added as soon as they are committed. The first load
+reads every row into arrays sorted once, later rows are merged into the sorted arrays.
+"""
+from typing import Callable, NamedTuple, Sequence, Tuple
+from threading import Event, Lock, Thread
+import logging
+import math
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models
+from ..config import settings
+from ..util.healpix import cone_ranges
+
+logger = logging.getLogger('app')
+
+# Pending rows are merged into the sorted arrays once there are this many
+MERGE_SIZE = 10000
+# New rows are found by id. Ids up to this far below the highest indexed one are read again in
+# case their transaction committed late, and skipped if they are already indexed.
+ID_OVERLAP = 10000
+
+
+class Positions(NamedTuple):
+    ids: np.ndarray
+    healpix: np.ndarray
+    vectors: np.ndarray
+
+    @classmethod
+    def empty(cls) -> 'Positions':
+        return cls(np.empty(0, np.int64), np.empty(0, np.int64), np.empty((0, 3)))
+
+    @classmethod
+    def from_arrays(cls, ids, ra, dec, healpix) -> 'Positions':
+        return cls(np.asarray(ids, np.int64), np.asarray(healpix, np.int64), unit_vectors(ra, dec))
+
+    def concatenate(self, other: 'Positions') -> 'Positions':
+        return Positions(*(np.concatenate([a, b]) for a, b in zip(self, other)))
+
+    def take(self, indices: np.ndarray) -> 'Positions':
+        return Positions(*(a[indices] for a in self))
+
+    def sorted(self) -> 'Positions':
+        return self.take(np.argsort(self.healpix, kind='stable'))
+
+    def merge(self, other: 'Positions') -> 'Positions':
+        """
+        Insert other into these positions, which are sorted by healpix, keeping them sorted
+        """
+        other = other.sorted()
+        at = np.searchsorted(self.healpix, other.healpix, side='right')
+        return Positions(*(np.insert(a, at, b, axis=0) for a, b in zip(self, other)))
+
+    @classmethod
+    def from_rows(cls, rows) -> 'Positions':
+        return cls.from_arrays(*zip(*rows)) if rows else cls.empty()
+
+
+def unit_vectors(ra, dec) -> np.ndarray:
+    ra = np.radians(np.asarray(ra, float))
+    dec = np.radians(np.asarray(dec, float))
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def chord(radius: float) -> float:
+    """
+    Straight line distance between two unit vectors `radius` degrees apart
+    """
+    return 2 * math.sin(math.radians(min(radius, 180)) / 2)
+
+
+def chord_to_degrees(chords: np.ndarray) -> np.ndarray:
+    return np.degrees(2 * np.arcsin(np.minimum(chords / 2, 1)))
+
+
+class SpatialIndex:
+    """
+    Thread safe index of (id, position) pairs. Searches read an immutable snapshot of the
+    arrays, writers replace the snapshot under a lock.
+    """
+    def __init__(self, order: int = settings.healpix_order):
+        self.order = order
+        self.max_id = 0
+        self.loaded = False
+        self._lock = Lock()
+        self._sync_lock = Lock()
+        # (sorted by healpix, pending)
+        self._state: Tuple[Positions, Positions] = (Positions.empty(), Positions.empty())
+        # Sorted ids which catch_up may read again, those above _floor
+        self._recent = np.empty(0, np.int64)
+        self._floor = 0
+
+    def __len__(self) -> int:
+        indexed, pending = self._state
+        return len(indexed.ids) + len(pending.ids)
+
+    def add(self, ids, ra, dec, healpix):
+        """
+        Add positions given as parallel sequences, ra/dec in degrees and healpix at self.order.
+        Ids which are already indexed are skipped.
+        """
+        if len(ids) == 0:
+            return
+        positions = Positions.from_arrays(ids, ra, dec, healpix)
+        with self._lock:
+            _, first = np.unique(positions.ids, return_index=True)
+            positions = positions.take(first[~np.isin(positions.ids[first], self._recent)])
+            if len(positions.ids) == 0:
+                return
+
+            indexed, pending = self._state
+            pending = pending.concatenate(positions)
+            if len(pending.ids) >= MERGE_SIZE:
+                indexed = indexed.merge(pending)
+                pending = Positions.empty()
+            self._state = (indexed, pending)
+
+            self.max_id = max(self.max_id, int(positions.ids.max()))
+            recent = np.union1d(self._recent, positions.ids)
+            self._recent = recent[recent > self._floor]
+
+    def catch_up(self, db: Session):
+        """
+        Add the sources inserted since the last call, including those of other processes
+        """
+        with self._sync_lock:
+            with self._lock:
+                cold = not self.loaded
+                # Rows at or below the floor are not read again, so their ids need not be kept
+                self._floor = self.max_id - ID_OVERLAP
+                self._recent = self._recent[self._recent > self._floor]
+            stmt = select(
+                models.Source.id, models.Source.ra, models.Source.dec, models.Source.healpix
+            ).where(
+                models.Source.id > self._floor
+            ).order_by(models.Source.id).execution_options(stream_results=True)
+            partitions = db.execute(stmt).partitions(settings.stream_batch_size)
+            if cold:
+                self._load(partitions)
+            else:
+                for partition in partitions:
+                    self.add(*zip(*partition))
+            self.loaded = True
+
+    def _load(self, partitions):
+        """
+        Fill an empty index with every row of partitions, sorting them once
+        """
+        chunks = [Positions.from_rows(partition) for partition in partitions]
+        if not chunks:
+            return
+        positions = Positions(*(np.concatenate(arrays) for arrays in zip(*chunks))).sorted()
+        with self._lock:
+            self._state = (positions, Positions.empty())
+            self.max_id = int(positions.ids.max())
+            self._floor = self.max_id - ID_OVERLAP
+            self._recent = np.sort(positions.ids[positions.ids > self._floor])
+
+    def refresh_forever(self, session_factory: Callable[[], Session], stop: Event):
+        while not stop.wait(settings.memory_index_refresh):
+            db = session_factory()
+            try:
+                self.catch_up(db)
+            except Exception:
+                logger.exception('Could not refresh the memory index')
+            finally:
+                db.close()
+
+    def _search(self, ra: float, dec: float, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        ids and chord distances of the positions within radius degrees of ra/dec
+        """
+        indexed, pending = self._state
+        ranges = np.array(cone_ranges(self.order, ra, dec, radius), np.int64).reshape(-1, 2)
+        starts = np.searchsorted(indexed.healpix, ranges[:, 0])
+        stops = np.searchsorted(indexed.healpix, ranges[:, 1])
+        indices = np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)] or [[]])
+        candidates = indexed.take(indices.astype(np.int64)).concatenate(pending)
+
+        distances = np.linalg.norm(candidates.vectors - unit_vectors(ra, dec), axis=1)
+        inside = distances <= chord(radius)
+        return candidates.ids[inside], distances[inside]
+
+    def cone(self, ra: float, dec: float, radius: float) -> np.ndarray:
+        """
+        Sorted ids of the sources within radius degrees of ra/dec
+        """
+        ids, _ = self._search(ra, dec, radius)
+        return np.sort(ids)
+
+    def nearest(self, ra: float, dec: float, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        ids and separations in degrees of the k sources closest to ra/dec, nearest first.
+        Searches cones of growing radius, starting from the radius expected to hold k sources
+        if they were spread evenly. Once a cone holds k sources it holds the k nearest.
+        """
+        count = len(self)
+        if count == 0:
+            return np.empty(0, np.int64), np.empty(0)
+        radius = math.degrees(2 * math.sqrt(min(k, count) / count))
+        while True:
+            ids, distances = self._search(ra, dec, radius)
+            if len(ids) >= k or radius >= 180:
+                break
+            radius *= 2
+        order = np.lexsort((ids, distances))[:k]
+        return ids[order], chord_to_degrees(distances[order])
+
+
+memory_index = SpatialIndex()
+_stop_refresh = Event()
+
+
+def use_memory_index() -> bool:
+    return settings.source_index_engine == 'memory' and memory_index.loaded
+
+
+def index_sources(sources: Sequence[models.Source]):
+    """
+    Add committed sources to memory_index, if it is in use
+    """
+    if use_memory_index():
+        memory_index.add(
+            [source.id for source in sources],
+            [source.ra for source in sources],
+            [source.dec for source in sources],
+            [source.healpix for source in sources],
+        )
+
+
+def start_memory_index(session_factory: Callable[[], Session]):
+    """
+    Load memory_index and keep it up to date from a daemon thread until stop_memory_index
+    """
+    db = session_factory()
+    try:
+        memory_index.catch_up(db)
+    finally:
+        db.close()
+    logger.info(f'Loaded {len(memory_index)} source positions into the memory index')
+    _stop_refresh.clear()
+    Thread(target=memory_index.refresh_forever, args=(session_factory, _stop_refresh), daemon=True).start()
+
+
+def stop_memory_index():
+    _stop_refresh.set()
@@ -1,24 +1,80 @@
-from fastapi import APIRouter, Depends
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Sequence, Tuple
 from sqlalchemy.orm import Session
 
-from . import crud, schemas, filters
-from ..database import get_db
-from ..util.web import ListQueryParams
+from . import crud, schemas, filters, ingest, crossmatch, events
+from ..config import settings
+from ..database import get_db, get_read_db
+from ..util.columnar import COLUMNAR_MEDIA_TYPE, FLOAT64, INT64, UTF8, encode_columns
+from ..util.web import ListQueryParams, NDJSON_MEDIA_TYPE, NEXT_CURSOR_HEADER, accepts, aiter_lines, abatched, ndjson_response
+from ..util.web import FieldsParams, NDJSONResponse, conditional_response, is_conditional, model_response
 
 router = APIRouter(
     prefix="/sources",
     tags=["sources"]
 )
 
+# Columns returned by listings in the columnar format
+COLUMNAR_COLUMNS = (('id', INT64), ('name', UTF8), ('ra', FLOAT64), ('dec', FLOAT64))
+
+
+def columnar_columns(fields: Sequence[str]) -> List[Tuple[str, str]]:
+    """
+    The COLUMNAR_COLUMNS among fields, which must include at least one of them
+    """
+    columns = [(name, dtype) for name, dtype in COLUMNAR_COLUMNS if name in fields]
+    if not columns:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f'None of the fields is available in the columnar format, choose from: '
+                   f'{", ".join(name for name, _ in COLUMNAR_COLUMNS)}'
+        )
+    return columns
+
 
 @router.get('/', response_model=List[schemas.ListSource])
 def get_sources(
+        request: Request,
+        response: Response,
         list_params: ListQueryParams = Depends(),
         source_filter: filters.SourceFilter = Depends(),
-        db: Session = Depends(get_db)
+        fields_params: FieldsParams = Depends(),
+        db: Session = Depends(get_read_db)
         ):
-    return crud.get_sources(db, list_params, source_filter)
+    """
+    List sources. With `Accept: application/x-ndjson` the listing is streamed as one
+    ListSource per line from a server side cursor. With `Accept: application/vnd.fastastro.columnar`
+    the id, name, ra and dec columns are returned packed in the format described in util.columnar.
+    Neither format sends an X-Next-Cursor header. `fields` restricts the fields of every source,
+    and the columns read, to those named.
+    """
+    fields = fields_params.select(schemas.ListSource)
+    if accepts(request, NDJSON_MEDIA_TYPE):
+        partitions = crud.iter_source_partitions(db, list_params, source_filter, fields)
+        return ndjson_response(row._asdict() for partition in partitions for row in partition)
+
+    if accepts(request, COLUMNAR_MEDIA_TYPE):
+        columns = columnar_columns(fields)
+        partitions = crud.iter_source_partitions(db, list_params, source_filter, columns=[name for name, _ in columns])
+        return Response(encode_columns(columns, partitions), media_type=COLUMNAR_MEDIA_TYPE)
+
+    if is_conditional(request):
+        # Answer from the validators alone when the page is unchanged
+        validators = crud.get_source_page_validators(db, list_params, source_filter, fields)
+        not_modified = conditional_response(request, response, *validators)
+        if not_modified:
+            return not_modified
+    page = crud.get_sources_cached(db, list_params, source_filter, fields)
+    not_modified = conditional_response(request, response, page.etag, page.last_modified)
+    if not_modified:
+        return not_modified
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    if fields_params.fields:
+        return model_response(response, page.items)
+    return page.items
 
 
 @router.post('/', response_model=schemas.Source)
@@ -26,9 +82,185 @@ def create_source(source: schemas.CreateSource, db: Session = Depends(get_db)):
     return crud.create_source(db, source)
 
 
+@router.post('/bulk', response_model=schemas.IngestResult)
+async def bulk_create_sources(request: Request, db: Session = Depends(get_db)):
+    """
+    Load many sources from a streamed NDJSON (default) or CSV (Content-Type: text/csv) body.
+    Every rejected record is counted, only the first ones are listed with their error.
+    """
+    loader = ingest.SourceLoader(db, ingest.format_for_content_type(request.headers.get('content-type')))
+    async for lines in abatched(aiter_lines(request.stream()), settings.ingest_batch_size):
+        await run_in_threadpool(loader.load_batch, lines)
+    return loader.result
+
+
+@router.post(
+    '/crossmatch',
+    response_class=NDJSONResponse,
+    responses={200: {'model': schemas.CrossmatchMatch, 'description': 'One CrossmatchMatch per line'}},
+)
+async def crossmatch_sources(
+        request: Request,
+        match: crossmatch.Match = Query(crossmatch.Match.best),
+        radius: float = Query(1 / 3600, gt=0, le=settings.crossmatch_max_radius),
+        unmatched: bool = Query(False),
+        db: Session = Depends(get_db)
+        ):
+    """
+    Cross-match a streamed NDJSON (default) or CSV (Content-Type: text/csv) catalog of positions
+    against sources in one spatial join. `radius` (degrees) applies to positions without their own.
+    Matches are streamed back as NDJSON, one CrossmatchMatch per line, in upload order.
+    """
+    loader = crossmatch.PositionLoader(db, ingest.format_for_content_type(request.headers.get('content-type')), radius)
+    async for lines in abatched(aiter_lines(request.stream()), settings.ingest_batch_size):
+        await run_in_threadpool(loader.load_batch, lines)
+    return ndjson_response(loader.matches(match, unmatched))
+
+
+@router.post(
+    '/cone_search',
+    response_class=NDJSONResponse,
+    responses={200: {'model': schemas.ConeMatches, 'description': 'One ConeMatches per line'}},
+)
+def cone_search(search: schemas.ConeSearch, db: Session = Depends(get_read_db)):
+    """
+    Resolve a batch of cones in one query. Matches are streamed back as NDJSON, one ConeMatches per input cone.
+    """
+    return ndjson_response(
+        {'id': cone_id, 'sources': sources} for cone_id, sources in crud.cone_search(db, search.cones)
+    )
+
+
+@router.get('/density', response_model=List[schemas.DensityTile])
+def get_density(
+        request: Request,
+        order: int = Query(..., ge=0, le=settings.density_order),
+        db: Session = Depends(get_read_db)
+        ):
+    """
+    Number of sources in every non empty nested HEALPix pixel at `order`, ordered by pixel and
+    read from precomputed tiles. Streamed as NDJSON with `Accept: application/x-ndjson`.
+    """
+    tiles = crud.get_density(db, order)
+    if accepts(request, NDJSON_MEDIA_TYPE):
+        return ndjson_response(tiles)
+    return tiles
+
+
+@router.get('/count', response_model=schemas.SourceCount)
+def count_sources(source_filter: filters.SourceFilter = Depends(), db: Session = Depends(get_read_db)):
+    """
+    Number of sources matching the filter, counted from the density tiles where possible
+    """
+    return {'count': crud.count_sources(db, source_filter)}
+
+
+@router.get('/nearest', response_model=List[schemas.NearestSource])
+def nearest_sources(
+        ra: float = Query(..., ge=-360, le=360),
+        dec: float = Query(..., ge=-90, le=90),
+        k: int = Query(10, ge=1, le=settings.nearest_max_k),
+        db: Session = Depends(get_read_db)
+        ):
+    """
+    The k sources closest to ra/dec ordered by angular separation, given in degrees
+    """
+    return crud.nearest_sources(db, ra, dec, k)
+
+
+@router.get('/changes', response_model=schemas.Changes)
+def get_changes(params: filters.ChangeFeedParams = Depends(), db: Session = Depends(get_db)):
+    """
+    Sources and comments created or updated since a checkpoint, for keeping a mirror in sync.
+    Start without a cursor (or with `since`), then pass the returned cursor to the next call,
+    right away while `more` is true. Changes appear settings.change_feed_lag seconds after they are made.
+    """
+    return crud.get_changes(db, params)
+
+
+@router.get('/events')
+async def source_events(
+        event_types: str = Query(','.join(events.EVENT_TYPES), alias='events', regex=events.EVENT_TYPES_REGEX),
+        cone_ra: float = Query(None, ge=-360, le=360),
+        cone_dec: float = Query(None, ge=-90, le=90),
+        cone_radius: float = Query(None, gt=0),
+        ):
+    """
+    Server-Sent Events of sources and comments as they are created, with their id and position
+    (of their source for comments), fetch them for the rest. With cone_ra, cone_dec and cone_radius only events within the cone
+    are sent. Streams may end when a client falls behind, reconnect and use /sources/changes to
+    catch up.
+    """
+    cone = (cone_ra, cone_dec, cone_radius) if None not in (cone_ra, cone_dec, cone_radius) else ()
+    subscription = events.Subscription(tuple(event_types.split(',')), cone)
+    return StreamingResponse(
+        events.event_stream(subscription),
+        media_type=events.EVENT_STREAM_MEDIA_TYPE,
+        headers={'Cache-Control': 'no-cache'},
+    )
+
+
+@router.get('/autocomplete', response_model=List[schemas.SourceName])
+def autocomplete(
+        q: str = Query(..., min_length=1),
+        limit: int = Query(10, ge=1, le=settings.autocomplete_max_limit),
+        db: Session = Depends(get_read_db)
+        ):
+    """
+    Name suggestions for typeahead: prefix matches first, then similar names
+    """
+    return crud.autocomplete(db, q, limit)
+
+
 @router.get('/{source_id}', response_model=schemas.Source)
-def get_source(source_id: int, db: Session = Depends(get_db)):
-    return crud.get_source(db, source_id)
+def get_source(
+        source_id: int,
+        request: Request,
+        response: Response,
+        fields_params: FieldsParams = Depends(),
+        db: Session = Depends(get_db)
+        ):
+    """
+    A source with its latest comments. `fields` restricts the fields, and the columns read, to those named.
+    """
+    fields = fields_params.select(schemas.Source)
+    version = crud.get_source_version(db, source_id)
+    if version is None:
+        return None
+    not_modified = conditional_response(request, response, *crud.source_validators(source_id, version, fields))
+    if not_modified:
+        return not_modified
+    read = crud.get_source_cached(db, source_id, version, fields)
+    if read is None:
+        return None
+    read_version, source = read
+    if read_version != version:
+        # Changed since its version was read, the validators describe the representation sent
+        not_modified = conditional_response(request, response, *crud.source_validators(source_id, read_version, fields))
+        if not_modified:
+            return not_modified
+    if fields_params.fields:
+        return model_response(response, source)
+    return source
+
+
+@router.get('/{source_id}/comments', response_model=List[schemas.ListComment])
+def get_comments(
+        source_id: int,
+        response: Response,
+        list_params: ListQueryParams = Depends(),
+        db: Session = Depends(get_db)
+        ):
+    """
+    Comments of a source, always keyset paginated and ordered by id unless `sort` is given
+    """
+    if not list_params.keyset:
+        list_params.sort = 'id'
+    comments = crud.get_comments(db, source_id, list_params)
+    next_cursor = list_params.next_cursor(comments)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return comments
 
 
 @router.post('/{source_id}/comment', response_model=schemas.Comment)
@@ -0,0 +1,80 @@
+from typing import Any, Dict, Hashable
+from collections import OrderedDict
+from threading import Lock
+import time
+
+from pydantic import BaseModel
+
+# All caches by name, for monitoring
+caches: Dict[str, 'LRUCache'] = {}
+
+_missing = object()
+
+
+class LRUCache:
+    """
+    Thread safe in-process cache holding at most maxsize entries, evicting the least
+    recently used one when full. Entries also expire ttl seconds after being set.
+    A maxsize of 0 disables the cache.
+    """
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._lock = Lock()
+        caches[name] = self
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            expires, value = self._entries.get(key, (None, _missing))
+            if value is _missing:
+                self.misses += 1
+                return default
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+def cache_key(*params: BaseModel) -> Hashable:
+    """
+    Hashable key from query parameter models, equal for equal parameter values
+    """
+    return tuple(tuple(sorted(p.dict().items())) for p in params)
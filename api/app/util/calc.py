@@ -1,11 +1,20 @@
+from typing import Union
 import math
 
+import numpy as np
+
 EARTH_RADIUS_METERS = 6371008.77141506
 
+# Little endian EWKB point with an SRID: byte order, geometry type, SRID, x, y
+EWKB_POINT = np.dtype([('order', 'u1'), ('type', '<u4'), ('srid', '<u4'), ('x', '<f8'), ('y', '<f8')])
+EWKB_POINT_TYPE = 1 | 0x20000000
+
+ArrayLike = Union[float, np.ndarray]
 
-def degrees_to_meters(degrees: float) -> float:
+
+def degrees_to_meters(degrees: ArrayLike) -> ArrayLike:
     """
-    Convert degrees to meters for use with PostGIS geography functions
+    Convert degrees to meters for use with PostGIS geography functions, degrees may be an array
     """
     return 2 * math.pi * EARTH_RADIUS_METERS * degrees / 360
 
@@ -15,3 +24,42 @@ def wkt_point(ra: float, dec: float, srid: int) -> str:
     Returns a Point a Well Known Text format given RA/Dec and SRID
     """
     return f'srid={srid};POINT({ra} {dec})'
+
+
+def normalize_ra(ra) -> np.ndarray:
+    """
+    RA wrapped to [0, 360)
+    """
+    ra = np.mod(np.asarray(ra, float), 360)
+    # mod of a tiny negative number rounds up to 360
+    return np.where(ra >= 360, 0.0, ra)
+
+
+def angular_separation(ra1, dec1, ra2, dec2) -> np.ndarray:
+    """
+    Angular separation in degrees between positions given in degrees, with the Vincenty formula
+    which is accurate at any separation
+    """
+    ra1, dec1, ra2, dec2 = (np.radians(np.asarray(a, float)) for a in (ra1, dec1, ra2, dec2))
+    delta = ra2 - ra1
+    sin_dec1, cos_dec1 = np.sin(dec1), np.cos(dec1)
+    sin_dec2, cos_dec2 = np.sin(dec2), np.cos(dec2)
+    x = cos_dec2 * np.sin(delta)
+    y = cos_dec1 * sin_dec2 - sin_dec1 * cos_dec2 * np.cos(delta)
+    z = sin_dec1 * sin_dec2 + cos_dec1 * cos_dec2 * np.cos(delta)
+    return np.degrees(np.arctan2(np.hypot(x, y), z))
+
+
+def ewkb_points(ra, dec, srid: int) -> np.ndarray:
+    """
+    Hex encoded EWKB Points given arrays of RA/Dec and an SRID, as an array of bytes strings.
+    PostGIS reads these without parsing text coordinates, for example in COPY input.
+    """
+    ra = np.asarray(ra, float)
+    points = np.empty(len(ra), EWKB_POINT)
+    points['order'] = 1
+    points['type'] = EWKB_POINT_TYPE
+    points['srid'] = srid
+    points['x'] = ra
+    points['y'] = dec
+    return np.frombuffer(points.tobytes().hex().encode(), dtype=f'S{2 * EWKB_POINT.itemsize}')
@@ -0,0 +1,137 @@
+"""
+A small packed columnar format for shipping query results to analysis clients.
+
+Layout of a message:
+
+    8 bytes     magic b'FACOL001'
+    uint32 LE   length of the JSON header
+    header      UTF-8 JSON: {"rows": n, "columns": [{"name", "dtype", "buffers": [[offset, length], ...]}]}
+    padding     to an 8 byte boundary, buffer offsets are relative to this point
+
+Every buffer starts on an 8 byte boundary. Numeric columns have one buffer of
+little endian '<i8' or '<f8' values that can be read with
+numpy.frombuffer(body, dtype, count=rows, offset=data_start + offset).
+'utf8' columns have an '<i8' buffer of rows + 1 offsets into a second buffer of
+UTF-8 bytes, as in Arrow.
+"""
+from array import array
+from typing import Dict, Iterable, List, Sequence, Tuple
+import json
+import struct
+import sys
+
+COLUMNAR_MEDIA_TYPE = 'application/vnd.fastastro.columnar'
+MAGIC = b'FACOL001'
+
+INT64 = '<i8'
+FLOAT64 = '<f8'
+UTF8 = 'utf8'
+
+_typecodes = {INT64: 'q', FLOAT64: 'd'}
+
+
+def _padding(length: int) -> bytes:
+    return b'\x00' * (-length % 8)
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class ColumnarEncoder:
+    """
+    Accumulates partitions of row tuples into typed arrays, one per column, and packs them
+    into a columnar message. `columns` is a list of (name, dtype) matching the row tuples.
+    """
+    def __init__(self, columns: Sequence[Tuple[str, str]]):
+        self.columns = columns
+        self.rows = 0
+        self.values: list = []
+        for _, dtype in columns:
+            if dtype == UTF8:
+                self.values.append((array('q', [0]), bytearray()))
+            else:
+                self.values.append(array(_typecodes[dtype]))
+
+    def add(self, partition: Sequence[Sequence]):
+        """
+        Transpose a list of rows straight into the column arrays
+        """
+        if not partition:
+            return
+        self.rows += len(partition)
+        for (_, dtype), column_values, column in zip(self.columns, self.values, zip(*partition)):
+            if dtype == UTF8:
+                offsets, data = column_values
+                for value in column:
+                    data += (value or '').encode()
+                    offsets.append(len(data))
+            else:
+                column_values.extend(column)
+
+    def encode(self) -> bytes:
+        buffers: List[bytes] = []
+        header_columns = []
+        offset = 0
+        for (name, dtype), column_values in zip(self.columns, self.values):
+            if dtype == UTF8:
+                offsets, data = column_values
+                column_buffers = [_little_endian(offsets), bytes(data)]
+            else:
+                column_buffers = [_little_endian(column_values)]
+
+            locations = []
+            for buffer in column_buffers:
+                locations.append([offset, len(buffer)])
+                buffers.append(buffer + _padding(len(buffer)))
+                offset += len(buffers[-1])
+            header_columns.append({'name': name, 'dtype': dtype, 'buffers': locations})
+
+        header = json.dumps({'rows': self.rows, 'columns': header_columns}).encode()
+        preamble = MAGIC + struct.pack('<I', len(header)) + header
+        return preamble + _padding(len(preamble)) + b''.join(buffers)
+
+
+def encode_columns(columns: Sequence[Tuple[str, str]], partitions: Iterable[Sequence[Sequence]]) -> bytes:
+    """
+    Pack rows into the columnar format, `partitions` yields lists of rows, for example
+    Result.partitions()
+    """
+    encoder = ColumnarEncoder(columns)
+    for partition in partitions:
+        encoder.add(partition)
+    return encoder.encode()
+
+
+def decode_columns(body: bytes) -> Dict[str, list]:
+    """
+    Read a columnar message back into lists, mainly useful for tests and pure Python clients
+    """
+    if body[:8] != MAGIC:
+        raise ValueError('Not a columnar message')
+    header_length, = struct.unpack('<I', body[8:12])
+    header = json.loads(body[12:12 + header_length])
+    start = 12 + header_length
+    start += -start % 8
+
+    result = {}
+    for column in header['columns']:
+        buffers = [body[start + offset:start + offset + length] for offset, length in column['buffers']]
+        if column['dtype'] == UTF8:
+            offsets = array('q')
+            offsets.frombytes(buffers[0])
+            if sys.byteorder == 'big':
+                offsets.byteswap()
+            result[column['name']] = [
+                buffers[1][offsets[i]:offsets[i + 1]].decode() for i in range(header['rows'])
+            ]
+        else:
+            values = array(_typecodes[column['dtype']])
+            values.frombytes(buffers[0])
+            if sys.byteorder == 'big':
+                values.byteswap()
+            result[column['name']] = values.tolist()
+    return result
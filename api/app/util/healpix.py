@@ -0,0 +1,229 @@
+"""
+Minimal HEALPix (nested scheme) implementation used to index Source positions.
+
+Pixels at order k have nside = 2**k and there are 12 * 4**k of them. In the
+nested scheme the 4 children of pixel p at order k are 4p..4p+3 at order k+1,
+so any pixel maps to a contiguous range of pixel numbers at a finer order.
+"""
+from typing import Iterator, List, Tuple
+import math
+
+import numpy as np
+
+MAX_ORDER = 29
+
+# Coordinates of the 12 base pixels, see Gorski et al. 2005
+JRLL = (2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4)
+JPLL = (1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7)
+
+# max_pixrad is a bound on the distance between corners and centers, pixel edges are not
+# great circles so pad it a little to keep coverings conservative
+PIXRAD_SAFETY = 1.1
+
+
+def npix(order: int) -> int:
+    return 12 << (2 * order)
+
+
+def _spread_bits(v: int) -> int:
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    v = (v | (v << 1)) & 0x5555555555555555
+    return v
+
+
+def _compress_bits(v: int) -> int:
+    v &= 0x5555555555555555
+    v = (v | (v >> 1)) & 0x3333333333333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF00FF00FF
+    v = (v | (v >> 8)) & 0x0000FFFF0000FFFF
+    v = (v | (v >> 16)) & 0x00000000FFFFFFFF
+    return v
+
+
+def ang2pix(order: int, ra: float, dec: float) -> int:
+    """
+    Nested pixel number containing the position ra/dec (degrees)
+    """
+    nside = 1 << order
+    z = math.sin(math.radians(dec))
+    za = abs(z)
+    tt = (math.radians(ra) / (math.pi / 2)) % 4.0
+
+    if za <= 2 / 3:
+        temp1 = nside * (0.5 + tt)
+        temp2 = nside * z * 0.75
+        jp = int(temp1 - temp2)
+        jm = int(temp1 + temp2)
+        ifp = jp >> order
+        ifm = jm >> order
+        if ifp == ifm:
+            face = ifp | 4
+        elif ifp < ifm:
+            face = ifp
+        else:
+            face = ifm + 8
+        ix = jm & (nside - 1)
+        iy = nside - (jp & (nside - 1)) - 1
+    else:
+        ntt = min(3, int(tt))
+        tp = tt - ntt
+        tmp = nside * math.sqrt(3 * (1 - za))
+        jp = min(int(tp * tmp), nside - 1)
+        jm = min(int((1 - tp) * tmp), nside - 1)
+        if z >= 0:
+            face, ix, iy = ntt, nside - jm - 1, nside - jp - 1
+        else:
+            face, ix, iy = ntt + 8, jp, jm
+
+    return (face << (2 * order)) + _spread_bits(ix) + (_spread_bits(iy) << 1)
+
+
+def ang2pix_array(order: int, ra, dec) -> np.ndarray:
+    """
+    ang2pix of arrays of positions, as an int64 array. Both regions are computed for every
+    position and the polar one selected where |z| > 2/3.
+    """
+    nside = 1 << order
+    z = np.sin(np.radians(np.asarray(dec, float)))
+    za = np.abs(z)
+    tt = np.mod(np.radians(np.asarray(ra, float)) / (math.pi / 2), 4.0)
+
+    temp1 = nside * (0.5 + tt)
+    temp2 = nside * z * 0.75
+    jp = (temp1 - temp2).astype(np.int64)
+    jm = (temp1 + temp2).astype(np.int64)
+    ifp = jp >> order
+    ifm = jm >> order
+    face = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix = jm & (nside - 1)
+    iy = nside - (jp & (nside - 1)) - 1
+
+    ntt = np.minimum(3, tt.astype(np.int64))
+    tp = tt - ntt
+    tmp = nside * np.sqrt(3 * (1 - za))
+    jp = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm = np.minimum(((1 - tp) * tmp).astype(np.int64), nside - 1)
+    polar, north = za > 2 / 3, z >= 0
+    face = np.where(polar, np.where(north, ntt, ntt + 8), face)
+    ix = np.where(polar, np.where(north, nside - jm - 1, jp), ix)
+    iy = np.where(polar, np.where(north, nside - jp - 1, jm), iy)
+
+    return (face << (2 * order)) + _spread_bits(ix) + (_spread_bits(iy) << 1)
+
+
+def pix2ang(order: int, pixel: int) -> Tuple[float, float]:
+    """
+    RA/Dec (degrees) of the center of a nested pixel
+    """
+    nside = 1 << order
+    npface = nside * nside
+    face = pixel >> (2 * order)
+    pixel &= npface - 1
+    ix = _compress_bits(pixel)
+    iy = _compress_bits(pixel >> 1)
+
+    jr = (JRLL[face] << order) - ix - iy - 1
+    if jr < nside:
+        nr = jr
+        z = 1 - nr * nr / (3 * npface)
+        kshift = 0
+    elif jr > 3 * nside:
+        nr = 4 * nside - jr
+        z = nr * nr / (3 * npface) - 1
+        kshift = 0
+    else:
+        nr = nside
+        z = (2 * nside - jr) * 2 / (3 * nside)
+        kshift = (jr - nside) & 1
+
+    jp = (JPLL[face] * nr + ix - iy + 1 + kshift) // 2
+    if jp > 4 * nside:
+        jp -= 4 * nside
+    if jp < 1:
+        jp += 4 * nside
+
+    phi = (jp - (kshift + 1) * 0.5) * (math.pi / 2 / nr)
+    return math.degrees(phi) % 360, math.degrees(math.asin(z))
+
+
+def max_pixrad(order: int) -> float:
+    """
+    Maximum angular distance (radians) between a pixel center and its corners
+    """
+    nside = 1 << order
+    t1 = (1 - 1 / nside) ** 2
+    return _angle(_vector_zphi(2 / 3, math.pi / (4 * nside)), _vector_zphi(1 - t1 / 3, 0))
+
+
+def _vector_zphi(z: float, phi: float) -> Tuple[float, float, float]:
+    sth = math.sqrt((1 - z) * (1 + z))
+    return sth * math.cos(phi), sth * math.sin(phi), z
+
+
+def _vector(ra: float, dec: float) -> Tuple[float, float, float]:
+    return _vector_zphi(math.sin(math.radians(dec)), math.radians(ra))
+
+
+def _angle(a: Tuple[float, float, float], b: Tuple[float, float, float]) -> float:
+    cross = (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+    return math.atan2(math.sqrt(sum(c * c for c in cross)), sum(x * y for x, y in zip(a, b)))
+
+
+def cover_cone(order: int, ra: float, dec: float, radius: float,
+               max_pixels: int = 128) -> Iterator[Tuple[int, int, bool]]:
+    """
+    Yield (order, pixel, fully_inside) for a set of pixels whose union covers the cone.
+    Pixels are refined down to `order`, stopping earlier if refining the boundary would
+    require more than `max_pixels` pixels, so the covering stays small for large cones.
+    """
+    center = _vector(ra, dec)
+    radius = math.radians(radius)
+    candidates = list(range(12))
+    depth = 0
+    while True:
+        pixrad = max_pixrad(depth) * PIXRAD_SAFETY
+        partial = []
+        for pixel in candidates:
+            distance = _angle(center, _vector(*pix2ang(depth, pixel)))
+            if distance > radius + pixrad:
+                continue
+            if distance + pixrad <= radius:
+                yield depth, pixel, True
+            elif depth == order:
+                yield depth, pixel, False
+            else:
+                partial.append(pixel)
+
+        if not partial:
+            return
+        if len(partial) * 4 > max_pixels:
+            for pixel in partial:
+                yield depth, pixel, False
+            return
+        candidates = [child for pixel in partial for child in range(pixel * 4, pixel * 4 + 4)]
+        depth += 1
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def cone_ranges(order: int, ra: float, dec: float, radius: float, max_pixels: int = 128) -> List[Tuple[int, int]]:
+    """
+    Half open [start, stop) ranges of nested pixel numbers at `order` covering the cone
+    """
+    ranges = []
+    for depth, pixel, _ in cover_cone(order, ra, dec, radius, max_pixels):
+        shift = 2 * (order - depth)
+        ranges.append((pixel << shift, (pixel + 1) << shift))
+    return merge_ranges(ranges)
@@ -0,0 +1,152 @@
+"""
+Latency metrics of requests and SQL statements.
+
+MetricsMiddleware times every request by route template, including the streaming of its body,
+and measures the size of its response. instrument_engine hooks into cursor execution to time
+every statement by its normalized SQL, and counts the rows it returned. The SQL time of each
+request is also added up, so the rest of its time, spent in FastAPI, validation and
+serialization, shows as the difference.
+"""
+from typing import Callable, Dict, List, Optional, Set
+from contextvars import ContextVar
+from functools import lru_cache
+import re
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .metrics import Histogram
+
+# Distinct statements timed separately, later ones are counted under OTHER_STATEMENT so the
+# number of series stays bounded
+MAX_STATEMENTS = 500
+OTHER_STATEMENT = 'other'
+UNMATCHED_ROUTE = 'unmatched'
+
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+request_duration = Histogram(
+    'http_request_duration_seconds', 'Time to handle a request and send its response', ['method', 'route', 'status']
+)
+request_db_duration = Histogram(
+    'http_request_db_seconds', 'Time a request spent executing SQL statements', ['method', 'route']
+)
+response_size = Histogram('http_response_size_bytes', 'Size of response bodies', ['method', 'route'], SIZE_BUCKETS)
+statement_duration = Histogram('db_statement_duration_seconds', 'Time to execute a SQL statement', ['statement'])
+statement_rows = Histogram(
+    'db_statement_rows', 'Rows returned or affected by a SQL statement', ['statement'], ROW_BUCKETS
+)
+
+# SQL seconds of the current request, a list so threads running sync routes add to the same total
+_request_db_seconds: ContextVar[Optional[List[float]]] = ContextVar('request_db_seconds', default=None)
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b|%\(\w+\)s|\$\d+|\?")
+_lists = re.compile(r'\?(?:\s*,\s*\?)+')
+# A comparison of a column with parameters repeated in a run of ORs or ANDs, like the BETWEENs of
+# a HEALPix prefilter, whose length varies with the values
+_terms = re.compile(
+    r'([\w."]+ (?:NOT )?(?:BETWEEN \? AND \?|(?:=|!=|<>|<|<=|>|>=|I?LIKE) \?))(?:\s+(?:OR|AND)\s+\1)+'
+)
+_whitespace = re.compile(r'\s+')
+# Labels given so far, at most MAX_STATEMENTS
+_statements: Set[str] = set()
+
+
+@lru_cache(maxsize=4096)
+def normalize_statement(statement: str) -> str:
+    """
+    SQL with literals and parameters replaced by ?, lists of them and runs of the same condition
+    collapsed into one and whitespace collapsed, so executions differing only in their values
+    share a label
+    """
+    statement = _literals.sub('?', statement)
+    statement = _lists.sub('?', statement)
+    statement = _terms.sub(r'\1', statement)
+    return _whitespace.sub(' ', statement).strip()
+
+
+def statement_label(statement: str) -> str:
+    normalized = normalize_statement(statement)
+    if normalized in _statements:
+        return normalized
+    if len(_statements) >= MAX_STATEMENTS:
+        return OTHER_STATEMENT
+    _statements.add(normalized)
+    return normalized
+
+
+# Statements are timed on their execution context, which is discarded with them when they raise
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._statement_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is None:
+        return
+    elapsed = time.perf_counter() - context._statement_start
+    label = statement_label(statement)
+    statement_duration.observe(elapsed, statement=label)
+    # -1 when unknown, as for server side cursors
+    if cursor.rowcount >= 0:
+        statement_rows.observe(cursor.rowcount, statement=label)
+    request_seconds = _request_db_seconds.get()
+    if request_seconds is not None:
+        request_seconds[0] += elapsed
+
+
+def instrument_engine(engine: Engine):
+    """
+    Time the statements executed by engine, pass the sync_engine of an AsyncEngine
+    """
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency, SQL time and response size of HTTP requests by route
+    """
+    def __init__(self, app: Callable):
+        self.app = app
+        self._route_paths: Optional[Dict[Callable, str]] = None
+
+    def route(self, scope: dict) -> str:
+        """
+        The path template of the route which handled the request, read from the endpoint the
+        router put in scope
+        """
+        if self._route_paths is None:
+            router = scope['app'].router
+            self._route_paths = {route.endpoint: route.path for route in router.routes if hasattr(route, 'endpoint')}
+        return self._route_paths.get(scope.get('endpoint'), UNMATCHED_ROUTE)
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        db_seconds = [0.0]
+        token = _request_db_seconds.set(db_seconds)
+        status = 500
+        size = 0
+
+        async def send_measured(message: dict):
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_measured)
+        finally:
+            _request_db_seconds.reset(token)
+            method, route = scope['method'], self.route(scope)
+            request_duration.observe(time.perf_counter() - start, method=method, route=route, status=status)
+            request_db_duration.observe(db_seconds[0], method=method, route=route)
+            response_size.observe(size, method=method, route=route)
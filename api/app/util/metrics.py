@@ -0,0 +1,142 @@
+"""
+Counters, gauges and histograms with labels, kept in memory by each worker.
+
+Metrics register themselves in `registry` by name when created, and are usually created
+at import time by the module they instrument. Each one lists its current values as
+(name, labels, value) samples, named as Prometheus expects: histograms give cumulative
+`_bucket` samples with an `le` label, `_sum` and `_count`. render() writes them all in
+the Prometheus text format.
+"""
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+from bisect import bisect_left
+from threading import Lock
+
+# Responses add the charset to text types
+PROMETHEUS_MEDIA_TYPE = 'text/plain; version=0.0.4'
+
+Labels = Dict[str, str]
+Sample = Tuple[str, Labels, float]
+
+# Seconds, the defaults of the Prometheus clients
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+registry: Dict[str, 'Metric'] = {}
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict = {}
+        self._lock = Lock()
+        registry[name] = self
+
+    def _key(self, labels: Labels) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} has labels {self.labels}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _labels(self, key: Tuple[str, ...]) -> Labels:
+        return dict(zip(self.labels, key))
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, self._labels(key), value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value which goes up and down. Gauges given a `collect` function read their values from it,
+    as {label values: value}, whenever they are sampled.
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 collect: Callable[[], Dict[Tuple[str, ...], float]] = None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> Iterator[Sample]:
+        if self.collect is None:
+            yield from super().samples()
+            return
+        for key, value in self.collect().items():
+            yield self.name, self._labels(tuple(map(str, key))), value
+
+
+class Histogram(Metric):
+    """
+    Counts of observations falling under each bucket bound, with their sum
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            # Per bucket counts, the last one for observations above every bound, and the sum
+            counts: List[float] = self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', dict(labels, le=_format_number(bound)), cumulative
+            yield f'{self.name}_sum', labels, counts[-1]
+            yield f'{self.name}_count', labels, cumulative
+
+
+def _format_number(value: float) -> str:
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render() -> str:
+    """
+    Every metric of the registry in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in list(registry.values()):
+        lines.append(f'# HELP {metric.name} {_escape(metric.help)}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labels, value in metric.samples():
+            if labels:
+                label_text = ','.join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+                name = f'{name}{{{label_text}}}'
+            lines.append(f'{name} {_format_number(value)}')
+    return '\n'.join(lines) + '\n'
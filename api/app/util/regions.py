@@ -0,0 +1,82 @@
+"""
+Geography shapes for RA/Dec box and polygon region filters.
+
+Geography edges are great circles, but the top and bottom edges of an RA/Dec box
+follow parallels of constant dec. Boxes are therefore approximated by polygons
+whose edges are densified and padded outwards, so they always cover the box, and
+the exact bounds are then checked on the ra and dec columns. Boxes are split into
+pieces at most BOX_MAX_WIDTH degrees wide, which keeps every piece well under a
+hemisphere and handles boxes crossing RA 0/360 the same way as any other.
+"""
+from typing import List, Sequence, Tuple
+import math
+
+# Degrees between vertices along the top and bottom edges of a box
+BOX_STEP = 1.0
+# Degrees a box is padded by, more than a great circle between vertices strays from the parallel
+BOX_PADDING = 0.01
+BOX_MAX_WIDTH = 90.0
+# Boxes reaching this close to a pole are covered by a cap around the pole instead
+POLE_MARGIN = 1.0
+
+
+def ra_width(ra_min: float, ra_max: float) -> float:
+    """
+    Width in degrees of the RA range going east from ra_min to ra_max, which wraps
+    through RA 0 when ra_max < ra_min
+    """
+    if ra_max >= ra_min:
+        return ra_max - ra_min
+    return ra_max + 360 - ra_min
+
+
+def _frange(start: float, stop: float, step: float) -> List[float]:
+    count = max(1, math.ceil((stop - start) / step))
+    return [start + (stop - start) * i / count for i in range(count + 1)]
+
+
+def box_pieces(ra_min: float, dec_min: float, ra_max: float, dec_max: float) -> List[List[Tuple[float, float]]]:
+    """
+    Closed rings of (ra, dec) vertices whose union covers the box
+    """
+    dec_low, dec_high = dec_min - BOX_PADDING, dec_max + BOX_PADDING
+    # Padding in RA grows towards the poles
+    ra_padding = BOX_PADDING / math.cos(math.radians(max(abs(dec_low), abs(dec_high))))
+    width = ra_width(ra_min, ra_max) + 2 * ra_padding
+    start = ra_min - ra_padding
+    if width >= 360:
+        start, width = 0, 360
+
+    rings = []
+    bounds = _frange(start, start + width, BOX_MAX_WIDTH)
+    for piece_start, piece_stop in zip(bounds, bounds[1:]):
+        ras = _frange(piece_start, piece_stop, BOX_STEP)
+        ring = [(ra, dec_low) for ra in ras] + [(ra, dec_high) for ra in reversed(ras)]
+        rings.append(ring + ring[:1])
+    return rings
+
+
+def _longitude(ra: float) -> float:
+    return (ra + 180) % 360 - 180
+
+
+def _ring_wkt(ring: Sequence[Tuple[float, float]]) -> str:
+    return '(' + ', '.join(f'{_longitude(ra)} {dec}' for ra, dec in ring) + ')'
+
+
+def box_ewkt(ra_min: float, dec_min: float, ra_max: float, dec_max: float, srid: int) -> str:
+    """
+    MULTIPOLYGON covering an RA/Dec box, see box_pieces
+    """
+    pieces = ', '.join(f'({_ring_wkt(ring)})' for ring in box_pieces(ra_min, dec_min, ra_max, dec_max))
+    return f'srid={srid};MULTIPOLYGON({pieces})'
+
+
+def polygon_ewkt(vertices: Sequence[Tuple[float, float]], srid: int) -> str:
+    """
+    POLYGON with (ra, dec) vertices joined by great circle arcs
+    """
+    ring = list(vertices)
+    if ring[0] != ring[-1]:
+        ring.append(ring[0])
+    return f'srid={srid};POLYGON({_ring_wkt(ring)})'
@@ -1,11 +1,433 @@
-from fastapi import Query
-from pydantic import BaseModel
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple, Type, TypeVar
+from typing import Union
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from functools import lru_cache
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, create_model
+from sqlalchemy import DateTime, and_, tuple_
+import base64
+import binascii
+import hashlib
+import json
+import re
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+# A sort key, prefixed with - for descending order
+SORT_REGEX = r'^-?\w+$'
+
+T = TypeVar('T')
 
 
 class ListQueryParams(BaseModel):
     """
-    Query parameters common to list operations
+    Query parameters common to list operations.
+
+    Passing `sort` (a whitelisted key, prefixed with - for descending order) or a `cursor`
+    returned by a previous page switches from offset to keyset pagination.
     """
     skip: int = Query(0)
     limit: int = Query(100, ge=1)
     order_by: str = Query(None)
+    sort: str = Query(None, regex=SORT_REGEX)
+    cursor: str = Query(None)
+
+    @property
+    def keyset(self) -> bool:
+        return bool(self.sort or self.cursor)
+
+    def keyset_position(self) -> Tuple[str, Optional[List[Any]]]:
+        """
+        The sort key and the (value, id) of the last row of the previous page, if any
+        """
+        if not self.cursor:
+            return self.sort or 'id', None
+        try:
+            sort, value, last_id = decode_cursor(self.cursor)
+            if not isinstance(sort, str) or not re.match(SORT_REGEX, sort):
+                raise ValueError('Malformed cursor sort')
+            if type(last_id) is not int or isinstance(value, (list, dict)):
+                raise ValueError('Malformed cursor position')
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Invalid cursor')
+        if self.sort and self.sort != sort:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail='Cursor was created with a different sort'
+            )
+        return sort, [value, last_id]
+
+    def next_cursor(self, items: Sequence[Any]) -> Optional[str]:
+        """
+        Cursor pointing after the last item, or None if this was the last page
+        """
+        if not self.keyset or len(items) < self.limit:
+            return None
+        sort, _ = self.keyset_position()
+        last = items[-1]
+        return encode_cursor([sort, jsonable_encoder(getattr(last, sort.lstrip('-'))), last.id])
+
+
+class FieldsParams(BaseModel):
+    """
+    Comma separated names of the fields to include in a response, all of them when absent
+    """
+    fields: str = Query(None, regex=r'^\w+(,\w+)*$')
+
+    def select(self, model: Type[BaseModel]) -> Tuple[str, ...]:
+        """
+        The requested fields of model, in the order they are declared
+        """
+        if not self.fields:
+            return tuple(model.__fields__)
+        names = set(self.fields.split(','))
+        unknown = names.difference(model.__fields__)
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f'Unknown fields {", ".join(sorted(unknown))}, choose from: {", ".join(model.__fields__)}'
+            )
+        return tuple(name for name in model.__fields__ if name in names)
+
+
+@lru_cache(maxsize=None)
+def sparse_model(model: Type[BaseModel], fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """
+    A copy of model with only `fields`, or model itself when those are all of its fields
+    """
+    if set(fields) == set(model.__fields__):
+        return model
+    return create_model(
+        model.__name__,
+        __config__=model.__config__,
+        **{name: (field.outer_type_, field.field_info) for name, field in model.__fields__.items() if name in fields}
+    )
+
+
+def model_response(response: Response, content: Any) -> JSONResponse:
+    """
+    JSON response of content that does not match the route's response_model, such as instances
+    of a sparse_model. Headers already set on the route's `response` are kept.
+    """
+    return JSONResponse(jsonable_encoder(content), headers=dict(response.headers))
+
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError('Malformed cursor')
+    if not isinstance(values, list):
+        raise ValueError('Malformed cursor')
+    return values
+
+
+def _cursor_value(column, value: Any) -> Any:
+    """
+    The sort value of a cursor as a parameter compared with column, ValueError if it cannot be one
+    """
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime):
+        if not isinstance(value, str):
+            raise ValueError('Malformed cursor value')
+        return datetime.fromisoformat(value)
+    python_type = column.type.python_type
+    if isinstance(value, bool) or not isinstance(value, (int, float) if python_type is float else python_type):
+        raise ValueError('Malformed cursor value')
+    return value
+
+
+def _seek(column, id_column, value: Any, last_id: int, descending: bool):
+    """
+    Rows after (value, last_id) in (column, id) order within the segment of the cursor: the rows
+    with a value, or the NULLs of a nullable column. The row comparison is never true for NULLs.
+    """
+    if value is None:
+        return and_(column.is_(None), id_column < last_id if descending else id_column > last_id)
+    key, position = tuple_(column, id_column), tuple_(value, last_id)
+    return key < position if descending else key > position
+
+
+def _keyset_sort(list_params: ListQueryParams, sort_keys: Dict[str, Any]):
+    """
+    The sort column, whether it is descending and the validated (value, id) cursor position or None
+    """
+    sort, after = list_params.keyset_position()
+    descending = sort.startswith('-')
+    column = sort_keys.get(sort.lstrip('-'))
+    if column is None:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f'Cannot sort by {sort}, choose one of: {", ".join(sort_keys)}'
+        )
+    if after:
+        value, last_id = after
+        try:
+            after = _cursor_value(column, value), last_id
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Invalid cursor')
+    return column, descending, after
+
+
+def keyset_paginate(query, list_params: ListQueryParams, sort_keys: Dict[str, Any], id_column):
+    """
+    Apply ordering and paging to a Query or Select. Keyset mode orders by (sort column, id)
+    and seeks past the previous page with a row comparison, so each sort key should be backed
+    by a (column, id) index. NULLs of a nullable column are ordered as in its index, last
+    ascending and first descending; a page running from one segment into the other is
+    completed by keyset_next_segment.
+    """
+    if not list_params.keyset:
+        return query.order_by(list_params.order_by).offset(list_params.skip).limit(list_params.limit)
+
+    column, descending, after = _keyset_sort(list_params, sort_keys)
+    if after:
+        value, last_id = after
+        if column is id_column:
+            query = query.filter(id_column < last_id if descending else id_column > last_id)
+        else:
+            query = query.filter(_seek(column, id_column, value, last_id, descending))
+
+    if column is id_column:
+        return query.order_by(id_column.desc() if descending else id_column).limit(list_params.limit)
+    if descending:
+        order = [column.desc().nulls_first() if column.nullable else column.desc(), id_column.desc()]
+    else:
+        order = [column.asc().nulls_last() if column.nullable else column, id_column]
+    return query.order_by(*order).limit(list_params.limit)
+
+
+def keyset_next_segment(query, list_params: ListQueryParams, sort_keys: Dict[str, Any], id_column, count: int):
+    """
+    The second seek of a page whose keyset_paginate statement returned count rows, or None when
+    there is none. After a cursor in one segment of a nullable sort column the page continues at
+    the start of the other, NULLs ascending and values descending, as its own index range scan.
+    """
+    if not list_params.keyset or count >= list_params.limit:
+        return None
+    column, descending, after = _keyset_sort(list_params, sort_keys)
+    if column is id_column or not column.nullable or not after:
+        return None
+    value, _ = after
+    limit = list_params.limit - count
+    if not descending and value is not None:
+        return query.filter(column.is_(None)).order_by(id_column).limit(limit)
+    if descending and value is None:
+        return query.filter(column.isnot(None)).order_by(column.desc(), id_column.desc()).limit(limit)
+    return None
+
+
+# Lone surrogates standing for the bytes decode_line could not decode
+_undecoded = re.compile('[\udc80-\udcff]')
+
+
+def decode_line(line: bytes) -> str:
+    """
+    A line of a request body as text. Bytes which are not valid UTF-8 are kept as lone surrogates,
+    so one bad line can be reported by whoever parses it instead of failing the whole body.
+    """
+    return line.decode(errors='surrogateescape').rstrip('\r')
+
+
+def undecodable(text: str) -> bool:
+    """
+    Whether text, from decode_line, had bytes which are not valid UTF-8
+    """
+    return _undecoded.search(text) is not None
+
+
+async def aiter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Split a streamed request body into numbered, non-blank text lines, decoded by decode_line,
+    without reading the whole body into memory
+    """
+    line_number = 0
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            line_number += 1
+            text = decode_line(line)
+            if text.strip():
+                yield line_number, text
+    if buffer.strip():
+        yield line_number + 1, decode_line(buffer)
+
+
+async def abatched(items: AsyncIterator[T], size: int) -> AsyncIterator[List[T]]:
+    """
+    Group an async iterator into lists of at most `size` items
+    """
+    batch: List[T] = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Strong entity tag from the JSON encoded parts, typically ids and updated timestamps
+    """
+    digest = hashlib.sha1(json.dumps(parts, default=jsonable_encoder).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def page_validators(items: Sequence[Any], *parts: Any) -> Tuple[str, Optional[datetime]]:
+    """
+    ETag and Last-Modified of a page of rows, from the id and updated of every row, so adding,
+    removing or updating any of them changes the tag. `parts` tell apart representations of
+    the same rows, such as different fields.
+    """
+    etag = make_etag(*parts, *((item.id, item.updated) for item in items))
+    return etag, max((item.updated for item in items), default=None)
+
+
+def _utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """
+    Whether the client's cached copy is current according to If-None-Match, or If-Modified-Since
+    when If-None-Match is absent
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        # Weak comparison, as GET responses may be compressed on the way
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    # HTTP dates have a resolution of one second
+    return _utc(last_modified).replace(microsecond=0) <= _utc(since)
+
+
+def is_conditional(request: Request) -> bool:
+    """
+    Whether the request carries a validator for not_modified to check
+    """
+    return 'if-none-match' in request.headers or 'if-modified-since' in request.headers
+
+
+def conditional_response(request: Request, response: Response, etag: str,
+                         last_modified: Optional[datetime] = None) -> Optional[Response]:
+    """
+    A 304 response if the client's cached copy is current, otherwise None after adding the
+    ETag and Last-Modified headers to `response`
+    """
+    headers = {'ETag': etag}
+    if last_modified is not None:
+        headers['Last-Modified'] = format_datetime(_utc(last_modified), usegmt=True)
+    if not_modified(request, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def accepts(request: Request, media_type: str) -> bool:
+    """
+    Whether the client explicitly listed media_type in its Accept header
+    """
+    accept = request.headers.get('accept', '')
+    return any(part.split(';')[0].strip() == media_type for part in accept.split(','))
+
+
+class _NDJSONBuffer:
+    """
+    Collects NDJSON lines into chunks of roughly chunk_size bytes
+    """
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.lines: List[str] = []
+        self.size = 0
+
+    def add(self, item: Any) -> Optional[str]:
+        line = json.dumps(item, default=jsonable_encoder) + '\n'
+        self.lines.append(line)
+        self.size += len(line)
+        if self.size >= self.chunk_size:
+            return self.flush()
+        return None
+
+    def flush(self) -> str:
+        chunk = ''.join(self.lines)
+        self.lines = []
+        self.size = 0
+        return chunk
+
+
+class NDJSONResponse(StreamingResponse):
+    """
+    A streamed NDJSON body. As a route's response_class it documents its responses, described with
+    `responses={200: {'model': ...}}`, under the NDJSON media type.
+    """
+    media_type = NDJSON_MEDIA_TYPE
+
+
+def ndjson_response(items: Union[Iterable[Any], AsyncIterable[Any]], chunk_size: int = 65536,
+                    **kwargs) -> NDJSONResponse:
+    """
+    Stream a sync or async iterable as newline delimited JSON, one item per line. Lines are
+    sent in chunks of roughly chunk_size bytes rather than one write per item.
+    """
+    buffer = _NDJSONBuffer(chunk_size)
+
+    def chunks():
+        for item in items:
+            chunk = buffer.add(item)
+            if chunk:
+                yield chunk
+        if buffer.lines:
+            yield buffer.flush()
+
+    async def achunks():
+        async for item in items:
+            chunk = buffer.add(item)
+            if chunk:
+                yield chunk
+        if buffer.lines:
+            yield buffer.flush()
+
+    body = achunks() if hasattr(items, '__aiter__') else chunks()
+    return NDJSONResponse(body, **kwargs)
+
+
+def replace_routes(app: FastAPI, router: APIRouter):
+    """
+    Include a router whose routes replace existing routes with the same path and methods.
+    Replacements keep the position of the route they replace, so matching order is unchanged.
+    """
+    existing = {(route.path, frozenset(route.methods)): i
+                for i, route in enumerate(app.router.routes) if isinstance(route, APIRoute)}
+    count = len(app.router.routes)
+    app.include_router(router)
+    added = app.router.routes[count:]
+    del app.router.routes[count:]
+    for route in added:
+        i = existing.get((route.path, frozenset(route.methods)))
+        if i is None:
+            app.router.routes.append(route)
+        else:
+            app.router.routes[i] = route
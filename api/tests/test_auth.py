@@ -63,6 +63,12 @@ class TestAuth:
         response = client.get(app.url_path_for('read_users_me'))
         assert response.json()['email'] == current_user.email
 
+    def test_get_me_not_modified(self, current_user):
+        etag = client.get(app.url_path_for('read_users_me')).headers['etag']
+        response = client.get(app.url_path_for('read_users_me'), headers={'If-None-Match': etag})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b''
+
     def test_update_me(self, db, current_user):
         data = {
             'first_name': 'NewName'
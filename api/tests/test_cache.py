@@ -0,0 +1,32 @@
+import time
+
+from app.util.cache import LRUCache, caches
+
+
+class TestLRUCache:
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache('test_lru', maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert cache.stats() == {
+            'size': 2, 'maxsize': 2, 'hits': 3, 'misses': 1, 'evictions': 1, 'expirations': 0,
+        }
+        assert caches['test_lru'] is cache
+
+    def test_expires_entries(self):
+        cache = LRUCache('test_ttl', maxsize=2, ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        assert cache.get('a') is None
+        assert cache.stats()['expirations'] == 1
+        assert cache.stats()['size'] == 0
+
+    def test_disabled(self):
+        cache = LRUCache('test_disabled', maxsize=0, ttl=60)
+        cache.set('a', 1)
+        assert cache.get('a') is None
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from app.util.calc import angular_separation, degrees_to_meters, ewkb_points, normalize_ra
+
+
+class TestCalc:
+    def test_degrees_to_meters_array(self):
+        meters = degrees_to_meters(np.array([0.5, 1.0]))
+        assert meters.tolist() == [degrees_to_meters(0.5), degrees_to_meters(1.0)]
+
+    def test_normalize_ra(self):
+        assert normalize_ra([-10, 0, 360, 370.5, -1e-20]).tolist() == [350, 0, 0, 10.5, 0]
+
+    def test_angular_separation(self):
+        separation = angular_separation([10.68, 0, 0, 359.9], [41.2, 90, 0, 0], [10.68, 0, 0, 0], [41.27, -90, 0, 0])
+        assert separation == pytest.approx([0.07, 180, 0, 0.1])
+        # Small separations keep their precision
+        assert angular_separation(0, 0, 1e-9, 0) == pytest.approx(1e-9)
+
+    def test_ewkb_points(self):
+        points = ewkb_points([10.5], [41.25], 4035)
+        assert points.tolist() == [b'0101000020c30f000000000000000025400000000000a04440']
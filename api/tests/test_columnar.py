@@ -0,0 +1,17 @@
+from app.util.columnar import encode_columns, decode_columns, FLOAT64, INT64, UTF8
+
+COLUMNS = (('id', INT64), ('name', UTF8), ('ra', FLOAT64))
+
+
+class TestColumnar:
+    def test_round_trip(self):
+        partitions = [[(1, 'M31', 10.68), (2, None, 202.47)], [], [(3, 'Ωmega', 0.0)]]
+        body = encode_columns(COLUMNS, partitions)
+        assert decode_columns(body) == {
+            'id': [1, 2, 3],
+            'name': ['M31', '', 'Ωmega'],
+            'ra': [10.68, 202.47, 0.0],
+        }
+
+    def test_empty(self):
+        assert decode_columns(encode_columns(COLUMNS, [])) == {'id': [], 'name': [], 'ra': []}
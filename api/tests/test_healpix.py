@@ -0,0 +1,40 @@
+import math
+import random
+
+from app.util.healpix import ang2pix, ang2pix_array, pix2ang, cone_ranges, npix
+
+
+class TestHealpix:
+    def test_pixel_round_trip(self):
+        for order in (0, 5, 14, 29):
+            for pixel in (0, npix(order) // 3, npix(order) - 1):
+                assert ang2pix(order, *pix2ang(order, pixel)) == pixel
+
+    def test_known_pixels(self):
+        # Values from healpy.ang2pix(nside, ra, dec, nest=True, lonlat=True)
+        assert ang2pix(0, 0, 0) == 4
+        assert ang2pix(0, 45, 90) == 0
+        assert ang2pix(4, 10.68, 41.27) == 169
+
+    def test_ang2pix_array(self):
+        random.seed(0)
+        ra = [random.uniform(-360, 360) for _ in range(1000)] + [0, 45, 360, 10.68]
+        dec = [random.uniform(-90, 90) for _ in range(1000)] + [0, 90, -90, 41.27]
+        for order in (0, 5, 29):
+            assert ang2pix_array(order, ra, dec).tolist() == [ang2pix(order, *position) for position in zip(ra, dec)]
+
+    def test_cone_ranges_cover_cone(self):
+        random.seed(0)
+        ra, dec, radius = 10.68, 41.27, 0.5
+        ranges = cone_ranges(14, ra, dec, radius)
+        for _ in range(500):
+            # random offsets strictly within the cone
+            distance = radius * 0.99 * math.sqrt(random.random())
+            angle = random.uniform(0, 2 * math.pi)
+            point_dec = dec + distance * math.sin(angle)
+            point_ra = ra + distance * math.cos(angle) / math.cos(math.radians(point_dec))
+            pixel = ang2pix(14, point_ra, point_dec)
+            assert any(start <= pixel < stop for start, stop in ranges)
+
+    def test_cone_ranges_whole_sky(self):
+        assert cone_ranges(10, 0, 0, 180) == [(0, npix(10))]
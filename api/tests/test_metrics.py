@@ -0,0 +1,95 @@
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError
+
+from app.main import app
+from app.database import InstrumentedQueuePool, pool_options, pool_overflows, pool_stats, pool_timeouts, pool_wait
+from app.util import instrumentation
+from app.util.instrumentation import normalize_statement, statement_label, statement_duration
+from app.util.metrics import Counter, Gauge, Histogram, render
+
+
+def samples(metric):
+    return {(name, tuple(sorted(labels.items()))): value for name, labels, value in metric.samples()}
+
+
+class TestMetrics:
+    def test_counter_and_gauge(self):
+        counter = Counter('test_total', 'A counter', ['kind'])
+        counter.inc(kind='a')
+        counter.inc(2, kind='a')
+        assert samples(counter) == {('test_total', (('kind', 'a'),)): 3}
+        with pytest.raises(ValueError):
+            counter.inc(other='a')
+
+        gauge = Gauge('test_gauge', 'A gauge', ['kind'], collect=lambda: {('a',): 1, ('b',): 2})
+        assert samples(gauge) == {('test_gauge', (('kind', 'a'),)): 1, ('test_gauge', (('kind', 'b'),)): 2}
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'A histogram', buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        assert samples(histogram) == {
+            ('test_seconds_bucket', (('le', '0.1'),)): 2,
+            ('test_seconds_bucket', (('le', '1.0'),)): 3,
+            ('test_seconds_bucket', (('le', '+Inf'),)): 4,
+            ('test_seconds_sum', ()): pytest.approx(3.65),
+            ('test_seconds_count', ()): 4,
+        }
+
+    def test_render(self):
+        counter = Counter('test_render_total', 'Counts "things"', ['path'])
+        counter.inc(path='/a\\b')
+        text = render()
+        assert '# HELP test_render_total Counts \\"things\\"\n# TYPE test_render_total counter\n' in text
+        assert 'test_render_total{path="/a\\\\b"} 1.0\n' in text
+
+    def test_normalize_statement(self):
+        assert normalize_statement(
+            "SELECT id FROM source\nWHERE id IN (%(id_1)s, %(id_2)s) AND name = 'it''s' LIMIT 10"
+        ) == 'SELECT id FROM source WHERE id IN (?) AND name = ? LIMIT ?'
+        assert normalize_statement('SELECT * FROM source_2 WHERE ra > $1') == 'SELECT * FROM source_2 WHERE ra > ?'
+        assert normalize_statement(
+            'SELECT id FROM source WHERE (source.healpix BETWEEN %(healpix_1)s AND %(healpix_2)s '
+            'OR source.healpix BETWEEN %(healpix_3)s AND %(healpix_4)s) AND ST_DWithin(source.location, ?, ?)'
+        ) == 'SELECT id FROM source WHERE (source.healpix BETWEEN ? AND ?) AND ST_DWithin(source.location, ?)'
+
+    def test_statement_labels_bounded(self, monkeypatch):
+        monkeypatch.setattr(instrumentation, '_statements', set())
+        monkeypatch.setattr(instrumentation, 'MAX_STATEMENTS', 1)
+        assert statement_label('SELECT 1') == 'SELECT ?'
+        assert statement_label('SELECT id FROM source') == instrumentation.OTHER_STATEMENT
+        assert instrumentation._statements == {'SELECT ?'}
+
+    def test_statement_metrics(self):
+        engine = create_engine('sqlite://')
+        instrumentation.instrument_engine(engine)
+        with engine.connect() as connection:
+            with pytest.raises(Exception):
+                connection.exec_driver_sql('SELECT * FROM missing_table')
+            connection.exec_driver_sql('SELECT 42')
+        assert samples(statement_duration)[('db_statement_duration_seconds_count', (('statement', 'SELECT ?'),))] >= 1
+
+    def test_pool_metrics(self):
+        engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool, **pool_options(
+            'test', pool_size=1, max_overflow=1, pool_timeout=0.01
+        ))
+        first = engine.connect()
+        second = engine.connect()
+        assert pool_stats()['test'] == {'size': 1, 'checked_in': 0, 'checked_out': 2, 'overflow': 1}
+        with pytest.raises(TimeoutError):
+            engine.connect()
+        first.close()
+        second.close()
+
+        assert samples(pool_overflows)[('db_pool_overflow_total', (('pool', 'test'),))] == 1
+        assert samples(pool_timeouts)[('db_pool_timeout_total', (('pool', 'test'),))] == 1
+        assert samples(pool_wait)[('db_pool_checkout_seconds_count', (('pool', 'test'),))] == 3
+
+    def test_request_metrics(self):
+        client = TestClient(app)
+        client.get('/stats/')
+        text = client.get('/metrics').text
+        assert 'http_request_duration_seconds_count{method="GET",route="/stats/",status="200"}' in text
+        assert 'http_response_size_bytes_count{method="GET",route="/stats/"}' in text
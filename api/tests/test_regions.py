@@ -0,0 +1,25 @@
+from app.util.regions import BOX_MAX_WIDTH, BOX_PADDING, box_ewkt, box_pieces, polygon_ewkt, ra_width
+
+
+class TestRegions:
+    def test_ra_width_wraps(self):
+        assert ra_width(10, 30) == 20
+        assert ra_width(350, 10) == 20
+
+    def test_box_pieces_cover_box(self):
+        pieces = box_pieces(300, -10, 40, 10)
+        assert len(pieces) == 2
+        ras = [ra for ring in pieces for ra, _ in ring]
+        assert min(ras) < 300 and max(ras) > 400
+        for ring in pieces:
+            assert ring[0] == ring[-1]
+            assert max(ra for ra, _ in ring) - min(ra for ra, _ in ring) <= BOX_MAX_WIDTH
+            assert {dec for _, dec in ring} == {-10 - BOX_PADDING, 10 + BOX_PADDING}
+
+    def test_box_ewkt_uses_longitudes(self):
+        ewkt = box_ewkt(350, -5, 10, 5, 4035)
+        assert ewkt.startswith('srid=4035;MULTIPOLYGON(((-10.01')
+        assert ' 350' not in ewkt
+
+    def test_polygon_ewkt_closes_ring(self):
+        assert polygon_ewkt([(1, 1), (2, 1), (2, 2)], 4035) == 'srid=4035;POLYGON((1 1, 2 1, 2 2, 1 1))'
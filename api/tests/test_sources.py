@@ -0,0 +1,420 @@
+from fastapi.testclient import TestClient
+from fastapi import status
+from datetime import datetime, timedelta
+import base64
+import json
+import pytest
+
+from app.main import app
+from app.config import settings
+from app.sources.models import Source, Comment
+from app.util.columnar import COLUMNAR_MEDIA_TYPE, decode_columns
+
+client = TestClient(app)
+
+
+class TestSources:
+    def test_bulk_create_sources(self, db):
+        body = '\n'.join([
+            json.dumps({'name': 'M31', 'ra': 10.68, 'dec': 41.27}),
+            json.dumps({'name': 'bad', 'ra': 'north'}),
+            json.dumps({'name': 'M51', 'ra': 202.47, 'dec': 47.2, 'data': {'type': 'galaxy'}}),
+            json.dumps({'name': 'nowhere', 'ra': 'nan', 'dec': 0}),
+            json.dumps({'name': 'below', 'ra': 1, 'dec': -95}),
+        ])
+        response = client.post(app.url_path_for('bulk_create_sources'), data=body)
+        assert response.status_code == status.HTTP_200_OK
+        result = response.json()
+        assert result['received'] == 5
+        assert result['inserted'] == 2
+        assert [error['line'] for error in result['batches'][0]['errors']] == [2, 4, 5]
+        assert db.query(Source).filter(Source.name == 'M51').one().data == {'type': 'galaxy'}
+
+        response = client.post(app.url_path_for('create_source'), json={'name': 'M31', 'ra': 'inf', 'dec': 0})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_bulk_create_sources_csv(self, db):
+        body = 'name,ra,dec,data\nM31,10.68,41.27,"{""type"": ""galaxy""}"\nM51,202.47,47.2,\n'
+        response = client.post(
+            app.url_path_for('bulk_create_sources'), data=body, headers={'Content-Type': 'text/csv'}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()['inserted'] == 2
+        assert db.query(Source).filter(Source.name == 'M31').one().data == {'type': 'galaxy'}
+
+    def test_bulk_create_sources_bad_encoding(self, db):
+        body = b'\n'.join([
+            json.dumps({'name': 'M31', 'ra': 10.68, 'dec': 41.27}).encode(),
+            b'{"name": "caf\xe9", "ra": 1, "dec": 1}',
+        ])
+        response = client.post(app.url_path_for('bulk_create_sources'), data=body)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()['inserted'] == 1
+        assert response.json()['batches'][0]['errors'][0]['line'] == 2
+
+    def test_bulk_create_sources_error_limits(self, db, monkeypatch):
+        monkeypatch.setattr(settings, 'ingest_batch_size', 4)
+        monkeypatch.setattr(settings, 'ingest_max_batch_errors', 2)
+        monkeypatch.setattr(settings, 'ingest_max_errors', 3)
+        body = '\n'.join([json.dumps({'name': 'M31', 'ra': 10.68, 'dec': 41.27})] + ['not json'] * 8)
+        response = client.post(app.url_path_for('bulk_create_sources'), data=body)
+        assert response.status_code == status.HTTP_200_OK
+        result = response.json()
+        assert (result['received'], result['inserted'], result['rejected']) == (9, 1, 8)
+        assert [batch['rejected'] for batch in result['batches']] == [3, 4, 1]
+        assert [len(batch['errors']) for batch in result['batches']] == [2, 1, 0]
+
+    def test_crossmatch(self, db):
+        db.add_all([
+            Source(name='M31', ra=10.68, dec=41.27),
+            Source(name='M32', ra=10.67, dec=40.87),
+            Source(name='M51', ra=202.47, dec=47.2),
+        ])
+        db.commit()
+
+        body = 'id,ra,dec,radius\na,10.68,41.2,1\nb,100,-20,\nc,202.47,47.2001,\n'
+        url = app.url_path_for('crossmatch_sources')
+        response = client.post(url, data=body, headers={'Content-Type': 'text/csv'}, params={'radius': 0.01})
+        assert response.status_code == status.HTTP_200_OK
+        results = [json.loads(line) for line in response.text.splitlines()]
+        assert [(r['id'], r['source']['name']) for r in results] == [('a', 'M31'), ('c', 'M51')]
+        assert results[0]['separation'] == pytest.approx(0.07, abs=1e-3)
+
+        response = client.post(
+            url, data=body, headers={'Content-Type': 'text/csv'}, params={'match': 'all', 'unmatched': True}
+        )
+        results = [json.loads(line) for line in response.text.splitlines()]
+        assert [(r['id'], r['source'] and r['source']['name']) for r in results] == [
+            ('a', 'M31'), ('a', 'M32'), ('b', None), ('c', 'M51')
+        ]
+
+        response = client.post(url, data=json.dumps({'id': 'a', 'ra': 10.68}))
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_cone_search(self, db):
+        db.add_all([
+            Source(name='M31', ra=10.68, dec=41.27),
+            Source(name='M51', ra=202.47, dec=47.2),
+        ])
+        db.commit()
+
+        data = {'cones': [
+            {'id': 'andromeda', 'ra': 10.7, 'dec': 41.3, 'radius': 0.5},
+            {'id': 'empty', 'ra': 100, 'dec': -20, 'radius': 0.5},
+            {'id': 'whirlpool', 'ra': 202.5, 'dec': 47.2, 'radius': 0.5},
+        ]}
+        response = client.post(app.url_path_for('cone_search'), json=data)
+        assert response.status_code == status.HTTP_200_OK
+        results = [json.loads(line) for line in response.text.splitlines()]
+        assert [r['id'] for r in results] == ['andromeda', 'empty', 'whirlpool']
+        assert [s['name'] for s in results[0]['sources']] == ['M31']
+        assert results[1]['sources'] == []
+        assert results[2]['sources'][0]['ra'] == pytest.approx(202.47)
+
+    def test_cone_search_documents_ndjson(self):
+        responses = app.openapi()['paths'][app.url_path_for('cone_search')]['post']['responses']
+        assert list(responses['200']['content']) == ['application/x-ndjson']
+        assert responses['200']['content']['application/x-ndjson']['schema']['$ref'].endswith('/ConeMatches')
+
+    def test_crossmatch_documents_ndjson(self):
+        responses = app.openapi()['paths'][app.url_path_for('crossmatch_sources')]['post']['responses']
+        assert list(responses['200']['content']) == ['application/x-ndjson']
+        assert responses['200']['content']['application/x-ndjson']['schema']['$ref'].endswith('/CrossmatchMatch')
+
+    def test_get_sources_keyset(self, db):
+        db.add_all([Source(name=name, ra=10, dec=10) for name in ('c', 'a', 'd', 'b', 'e')])
+        db.commit()
+
+        names = []
+        params = {'sort': '-name', 'limit': 2}
+        while True:
+            response = client.get(app.url_path_for('get_sources'), params=params)
+            assert response.status_code == status.HTTP_200_OK
+            names += [source['name'] for source in response.json()]
+            if 'X-Next-Cursor' not in response.headers:
+                break
+            params = {'cursor': response.headers['X-Next-Cursor'], 'limit': 2}
+
+        assert names == ['e', 'd', 'c', 'b', 'a']
+
+    def test_get_sources_keyset_null_names(self, db):
+        db.add_all([Source(name=name, ra=10, dec=10) for name in ('b', None, 'a', None, 'c')])
+        db.commit()
+
+        for sort, expected in (('name', ['a', 'b', 'c', None, None]), ('-name', [None, None, 'c', 'b', 'a'])):
+            names = []
+            params = {'sort': sort, 'limit': 2}
+            while True:
+                response = client.get(app.url_path_for('get_sources'), params=params)
+                names += [source['name'] for source in response.json()]
+                if 'X-Next-Cursor' not in response.headers:
+                    break
+                params = {'cursor': response.headers['X-Next-Cursor'], 'limit': 2}
+            assert names == expected
+
+    def test_get_sources_tampered_cursor(self, db):
+        for values in ([1, 'a', 1], ['name', 'a', 'x'], ['created', 5, 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            response = client.get(app.url_path_for('get_sources'), params={'cursor': cursor})
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_cached_reads_invalidated_by_writes(self, db):
+        source = Source(name='M31', ra=10.68, dec=41.27)
+        db.add(source)
+        db.commit()
+        assert len(client.get(app.url_path_for('get_sources')).json()) == 1
+        assert client.get(app.url_path_for('get_source', source_id=source.id)).json()['comments'] == []
+
+        client.post(app.url_path_for('create_source'), json={'name': 'M51', 'ra': 202.47, 'dec': 47.2})
+        client.post(app.url_path_for('create_comment', source_id=source.id), json={'content': 'bright'})
+        assert len(client.get(app.url_path_for('get_sources')).json()) == 2
+        assert len(client.get(app.url_path_for('get_source', source_id=source.id)).json()['comments']) == 1
+        assert 'source_list' in client.get('/stats/').json()['caches']
+
+    def test_conditional_get(self, db):
+        source = Source(name='M31', ra=10.68, dec=41.27)
+        db.add(source)
+        db.commit()
+        detail_url = app.url_path_for('get_source', source_id=source.id)
+        for url in (app.url_path_for('get_sources'), detail_url):
+            response = client.get(url)
+            etag, last_modified = response.headers['etag'], response.headers['last-modified']
+            assert client.get(url, headers={'If-None-Match': etag}).status_code == status.HTTP_304_NOT_MODIFIED
+            response = client.get(url, headers={'If-Modified-Since': last_modified})
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        client.post(app.url_path_for('create_comment', source_id=source.id), json={'content': 'bright'})
+        response = client.get(detail_url, headers={'If-None-Match': etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers['etag'] != etag
+
+    def test_detail_etag_matches_cached_body(self, db):
+        source = Source(name='M31', ra=10.68, dec=41.27)
+        db.add(source)
+        db.commit()
+        detail_url = app.url_path_for('get_source', source_id=source.id)
+        etag = client.get(detail_url).headers['etag']
+
+        # Written behind the cache, as by another worker
+        source.name = 'Andromeda'
+        db.commit()
+        response = client.get(detail_url, headers={'If-None-Match': etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()['name'] == 'Andromeda'
+        response = client.get(detail_url, headers={'If-None-Match': response.headers['etag']})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_density_and_count(self, db):
+        for source in [
+            {'name': 'M31', 'ra': 10.68, 'dec': 41.27},
+            {'name': 'M32', 'ra': 10.67, 'dec': 40.87},
+            {'name': 'M51', 'ra': 202.47, 'dec': 47.2},
+        ]:
+            client.post(app.url_path_for('create_source'), json=source)
+
+        tiles = client.get(app.url_path_for('get_density'), params={'order': 0}).json()
+        assert sum(tile['count'] for tile in tiles) == 3
+        assert len(tiles) == 2
+        assert client.get(app.url_path_for('get_density'), params={'order': 99}).status_code == 422
+
+        def count(**params):
+            return client.get(app.url_path_for('count_sources'), params=params).json()['count']
+
+        assert count() == 3
+        assert count(cone_ra=10.7, cone_dec=41, cone_radius=5) == 2
+        assert count(cone_ra=10.68, cone_dec=41.27, cone_radius=0.1) == 1
+        assert count(name_contains='M5') == 1
+
+    def test_nearest_sources(self, db):
+        db.add_all([
+            Source(name='M31', ra=10.68, dec=41.27),
+            Source(name='M32', ra=10.67, dec=40.87),
+            Source(name='M51', ra=202.47, dec=47.2),
+        ])
+        db.commit()
+
+        response = client.get(app.url_path_for('nearest_sources'), params={'ra': 10.68, 'dec': 41.2, 'k': 2})
+        assert response.status_code == status.HTTP_200_OK
+        results = response.json()
+        assert [r['name'] for r in results] == ['M31', 'M32']
+        assert results[0]['separation'] == pytest.approx(0.07, abs=1e-3)
+        assert results[1]['separation'] == pytest.approx(0.33, abs=1e-2)
+
+    def test_get_sources_box_and_polygon(self, db):
+        db.add_all([
+            Source(name='east', ra=5, dec=1),
+            Source(name='west', ra=355, dec=-1),
+            Source(name='outside', ra=20, dec=0),
+            Source(name='polar', ra=123, dec=89.5),
+        ])
+        db.commit()
+
+        def names(**params):
+            return sorted(s['name'] for s in client.get(app.url_path_for('get_sources'), params=params).json())
+
+        assert names(box='350,-5,10,5') == ['east', 'west']
+        assert names(box='-10,-5,10,5') == ['east', 'west']
+        assert names(box='100,89,130,90') == ['polar']
+        assert names(polygon='350,-5,10,-5,10,5,350,5') == ['east', 'west']
+        assert client.get(app.url_path_for('get_sources'), params={'box': '1,2,3'}).status_code == 422
+        assert client.get(app.url_path_for('get_sources'), params={'box': '1,5,3,2'}).status_code == 422
+        assert client.get(app.url_path_for('get_sources'), params={'polygon': 'a,b'}).status_code == 422
+
+    def test_get_sources_data_filter(self, db):
+        db.add_all([
+            Source(name='M31', ra=10.68, dec=41.27, data={'type': 'galaxy', 'mag': 3.4, 'phot': {'g': 4.1}}),
+            Source(name='M51', ra=202.47, dec=47.2, data={'type': 'galaxy', 'mag': 8.4}),
+            Source(name='Vega', ra=279.23, dec=38.78, data={'type': 'star', 'mag': 0.03}),
+        ])
+        db.commit()
+
+        def names(*conditions):
+            response = client.get(app.url_path_for('get_sources'), params={'data': ','.join(conditions)})
+            return sorted(s['name'] for s in response.json())
+
+        assert names('type:eq:galaxy') == ['M31', 'M51']
+        assert names('type:eq:galaxy', 'mag:lt:5') == ['M31']
+        assert names('type:eq:"star"') == ['Vega']
+        assert names('mag:ge:3.4') == ['M31', 'M51']
+        assert names('phot:exists') == ['M31']
+        assert names('phot.g:le:4.1') == ['M31']
+        for condition in ('mag:between:1', 'mag:lt:NaN', 'mag:gt:-Infinity', 'mag:eq:1e999', 'phot:eq:{"g":NaN}'):
+            response = client.get(app.url_path_for('get_sources'), params={'data': condition})
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_change_feed(self, db):
+        past = datetime.utcnow() - timedelta(minutes=5)
+        sources = [Source(name=f'source {i}', ra=i, dec=i, updated=past + timedelta(seconds=i)) for i in range(3)]
+        db.add_all(sources)
+        db.commit()
+        db.add(Comment(content='first', source_id=sources[0].id, updated=past))
+        db.commit()
+
+        response = client.get(app.url_path_for('get_changes'), params={'limit': 2})
+        assert response.status_code == status.HTTP_200_OK
+        changes = response.json()
+        assert [s['name'] for s in changes['sources']] == ['source 0', 'source 1']
+        assert [c['content'] for c in changes['comments']] == ['first']
+        assert changes['more']
+
+        changes = client.get(app.url_path_for('get_changes'), params={'cursor': changes['cursor']}).json()
+        assert [s['name'] for s in changes['sources']] == ['source 2']
+        assert changes['comments'] == []
+        assert not changes['more']
+
+        # Changes made within change_feed_lag are held back
+        db.add(Source(name='fresh', ra=0, dec=0))
+        db.commit()
+        changes = client.get(app.url_path_for('get_changes'), params={'cursor': changes['cursor']}).json()
+        assert changes['sources'] == []
+
+        response = client.get(app.url_path_for('get_changes'), params={'cursor': 'nonsense'})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_get_sources_bad_sort(self, db):
+        response = client.get(app.url_path_for('get_sources'), params={'sort': 'data'})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_get_sources_ndjson(self, db):
+        db.add_all([Source(name=f'source {i}', ra=i, dec=-i, data={'i': i}) for i in range(5)])
+        db.commit()
+
+        response = client.get(
+            app.url_path_for('get_sources'), params={'sort': 'id'}, headers={'Accept': 'application/x-ndjson'}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers['content-type'].startswith('application/x-ndjson')
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [row['name'] for row in rows] == [f'source {i}' for i in range(5)]
+        assert rows[3]['dec'] == pytest.approx(-3)
+        assert rows[3]['data'] == {'i': 3}
+
+    def test_get_sources_columnar(self, db):
+        db.add_all([Source(name=f'source {i}', ra=i + 0.5, dec=i) for i in range(3)])
+        db.commit()
+
+        response = client.get(
+            app.url_path_for('get_sources'),
+            params={'sort': 'id'},
+            headers={'Accept': COLUMNAR_MEDIA_TYPE}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        columns = decode_columns(response.content)
+        assert columns['name'] == ['source 0', 'source 1', 'source 2']
+        assert columns['ra'] == pytest.approx([0.5, 1.5, 2.5])
+        assert set(columns) == {'id', 'name', 'ra', 'dec'}
+
+        response = client.get(
+            app.url_path_for('get_sources'),
+            params={'fields': 'data'},
+            headers={'Accept': COLUMNAR_MEDIA_TYPE}
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_sparse_fields(self, db):
+        source = Source(name='M31', ra=10.68, dec=41.27, data={'type': 'galaxy'})
+        db.add(source)
+        db.commit()
+
+        response = client.get(app.url_path_for('get_sources'), params={'fields': 'id,ra,dec', 'sort': 'id'})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == [{'ra': pytest.approx(10.68), 'dec': pytest.approx(41.27), 'id': source.id}]
+        full = client.get(app.url_path_for('get_sources'), params={'sort': 'id'})
+        assert full.json()[0]['data'] == {'type': 'galaxy'}
+        assert full.headers['ETag'] != response.headers['ETag']
+
+        response = client.get(app.url_path_for('get_source', source_id=source.id), params={'fields': 'name'})
+        assert response.json() == {'name': 'M31'}
+        response = client.get(app.url_path_for('get_sources'), params={'fields': 'name,location'})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_source_ra_dec_columns(self, db):
+        source = Source(name='wrapped', ra=-10, dec=5)
+        db.add(source)
+        db.commit()
+
+        response = client.get(app.url_path_for('get_source', source_id=source.id))
+        assert response.json()['ra'] == pytest.approx(350)
+        assert response.json()['dec'] == pytest.approx(5)
+
+    def test_get_source_caps_comments(self, db):
+        source = Source(name='popular', ra=10, dec=10)
+        source.comments = [Comment(content=f'comment {i}') for i in range(settings.source_inline_comments + 5)]
+        db.add(source)
+        db.commit()
+
+        response = client.get(app.url_path_for('get_source', source_id=source.id))
+        comments = response.json()['comments']
+        assert len(comments) == settings.source_inline_comments
+        assert comments[0]['content'] == f'comment {settings.source_inline_comments + 4}'
+
+    def test_get_comments(self, db):
+        source = Source(name='popular', ra=10, dec=10)
+        source.comments = [Comment(content=f'comment {i}') for i in range(5)]
+        db.add(source)
+        db.commit()
+
+        url = app.url_path_for('get_comments', source_id=source.id)
+        response = client.get(url, params={'limit': 3})
+        assert [c['content'] for c in response.json()] == ['comment 0', 'comment 1', 'comment 2']
+
+        response = client.get(url, params={'limit': 3, 'cursor': response.headers['X-Next-Cursor']})
+        assert [c['content'] for c in response.json()] == ['comment 3', 'comment 4']
+        assert 'X-Next-Cursor' not in response.headers
+
+    def test_get_sources_name_contains_escapes_wildcards(self, db):
+        db.add_all([Source(name='100% real', ra=1, dec=1), Source(name='1000 real', ra=1, dec=1)])
+        db.commit()
+
+        response = client.get(app.url_path_for('get_sources'), params={'name_contains': '0%'})
+        assert [source['name'] for source in response.json()] == ['100% real']
+
+    def test_autocomplete(self, db):
+        db.add_all([Source(name=name, ra=1, dec=1) for name in ('NGC 224', 'NGC 5194', 'NGC 5195', 'M31')])
+        db.commit()
+
+        response = client.get(app.url_path_for('autocomplete'), params={'q': 'NGC 51', 'limit': 3})
+        assert response.status_code == status.HTTP_200_OK
+        names = [source['name'] for source in response.json()]
+        assert names[:2] == ['NGC 5194', 'NGC 5195']
+        assert set(response.json()[0]) == {'id', 'name'}
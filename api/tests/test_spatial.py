@@ -0,0 +1,72 @@
+import math
+
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.sources.spatial import ID_OVERLAP, SpatialIndex
+from app.util.healpix import ang2pix, _angle, _vector
+
+
+@pytest.fixture(scope='module')
+def positions():
+    rng = np.random.default_rng(42)
+    ra = rng.uniform(0, 360, 5000)
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, 5000)))
+    healpix = [ang2pix(settings.healpix_order, r, d) for r, d in zip(ra, dec)]
+    return np.arange(1, 5001), ra, dec, healpix
+
+
+def separations(positions, ra, dec):
+    center = _vector(ra, dec)
+    ids, ras, decs, _ = positions
+    return sorted((math.degrees(_angle(center, _vector(r, d))), i) for i, r, d in zip(ids, ras, decs))
+
+
+class TestSpatialIndex:
+    @pytest.mark.parametrize('ra,dec,radius', [(10, 41, 8), (359.5, 0, 4), (200, -89, 6)])
+    def test_cone_and_nearest(self, positions, ra, dec, radius):
+        index = SpatialIndex()
+        index.add(*positions)
+        expected = separations(positions, ra, dec)
+
+        assert index.cone(ra, dec, radius).tolist() == sorted(i for s, i in expected if s <= radius)
+        ids, seps = index.nearest(ra, dec, 5)
+        assert ids.tolist() == [i for _, i in expected[:5]]
+        assert seps == pytest.approx([s for s, _ in expected[:5]])
+
+    def test_add_skips_indexed_ids(self, positions):
+        ids, ra, dec, healpix = positions
+        index = SpatialIndex()
+        index.add(ids[:3000], ra[:3000], dec[:3000], healpix[:3000])
+        index.add(ids[2000:], ra[2000:], dec[2000:], healpix[2000:])
+        assert len(index) == 5000
+        assert index.max_id == 5000
+
+    def test_catch_up(self, positions):
+        class Rows:
+            """
+            Stands in for a Session reading (id, ra, dec, healpix) rows above the floor of the query
+            """
+            def __init__(self, rows):
+                self.rows = rows
+
+            def execute(self, stmt):
+                floor = stmt.whereclause.right.value
+                self.result = [row for row in self.rows if row[0] > floor]
+                return self
+
+            def partitions(self, size):
+                return (self.result[i:i + size] for i in range(0, len(self.result), size))
+
+        rows = list(zip(*positions))
+        index = SpatialIndex()
+        index.catch_up(Rows(rows[:4000]))
+        assert len(index) == 4000 and index.loaded
+        index.catch_up(Rows(rows))
+        assert len(index) == 5000
+        assert index.max_id == 5000
+        assert len(index._recent) <= ID_OVERLAP
+        assert index.cone(10, 41, 8).tolist() == sorted(
+            i for s, i in separations(positions, 10, 41) if s <= 8
+        )